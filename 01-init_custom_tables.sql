@@ -1,40 +1,63 @@
+-- Databases created by an earlier version of this script: run the
+-- 0N-migrate_*.sql scripts in order, then this script again
 CREATE DATABASE IF NOT EXISTS cld;
 USE cld;
 CREATE TABLE IF NOT EXISTS nodes_custom (
     cldID INT NOT NULL,
+    -- Loopy node id: the loop and route paths are encoded with it
+    nodeID INT NOT NULL,
     node_name VARCHAR(255) NOT NULL,
     pos_x DOUBLE,
     pos_y DOUBLE,
-    PRIMARY KEY (cldID, node_name) -- Assuming a composite primary key
+    PRIMARY KEY (cldID, node_name), -- Assuming a composite primary key
+    UNIQUE KEY uq_nodes_custom_id (cldID, nodeID)
+);
+
+-- One row per custom diagram (cldID, derived from the session id) with the
+-- time of its last load: LoadAnalyses.purge_expired deletes the diagrams of
+-- ended sessions
+CREATE TABLE IF NOT EXISTS custom_clds (
+    cldID INT NOT NULL PRIMARY KEY,
+    last_loaded_at TIMESTAMP NOT NULL,
+    INDEX idx_custom_clds_last_loaded (last_loaded_at)
 );
 
 CREATE TABLE IF NOT EXISTS relationships_custom (
-    relationshipID INT NOT NULL PRIMARY KEY,
+    relationshipID INT NOT NULL,
     type TEXT,
     delay TEXT,
     cldID INT NOT NULL,
+    -- Neo4j relationship ids are unique only within one diagram's lifetime
+    PRIMARY KEY (cldID, relationshipID),
     FOREIGN KEY (cldID) REFERENCES nodes_custom(cldID) ON DELETE CASCADE
 );
 
 CREATE TABLE IF NOT EXISTS routes_custom (
     cldID INT NOT NULL,
     routeID INT NOT NULL,
-    start_node TEXT,
-    end_node TEXT,
-    route TEXT,
+    start_node VARCHAR(255),
+    end_node VARCHAR(255),
+    -- Packed int32 array alternating nodeID and relationshipID (see path_codec.py)
+    route_code VARBINARY(1024),
     route_length INT,
-    state TEXT,
+    state VARCHAR(32),
     PRIMARY KEY (cldID, routeID),
+    -- Route filter form: diagram, start/end variable, then length and state
+    INDEX idx_routes_custom_endpoints (cldID, start_node, end_node, route_length, state),
     FOREIGN KEY (cldID) REFERENCES nodes_custom(cldID) ON DELETE CASCADE
 );
 
 CREATE TABLE IF NOT EXISTS loops_custom (
     cldID INT NOT NULL,
     loopID INT NOT NULL,
-    loop_path TEXT,
-    state TEXT,
+    -- Packed int32 array alternating nodeID and relationshipID (see path_codec.py)
+    loop_code VARBINARY(1024),
+    state VARCHAR(32),
     loop_length INT,
     PRIMARY KEY (cldID, loopID),
+    -- Loop filter form: diagram, then state and/or length
+    INDEX idx_loops_custom_state_length (cldID, state, loop_length),
+    INDEX idx_loops_custom_length (cldID, loop_length),
     FOREIGN KEY (cldID) REFERENCES nodes_custom(cldID) ON DELETE CASCADE
 );
 
@@ -42,6 +65,7 @@ CREATE TABLE IF NOT EXISTS bridge_nodes_loops_custom (
     cldID INT NOT NULL,
     node_name VARCHAR(255) NOT NULL,
     loopID INT NOT NULL,
+    -- Also serves the variable filter: (cldID, node_name) lookup, then join on loopID
     PRIMARY KEY (cldID, node_name, loopID),
     FOREIGN KEY (cldID, node_name) REFERENCES nodes_custom(cldID, node_name) ON DELETE CASCADE,
     FOREIGN KEY (cldID, loopID) REFERENCES loops_custom(cldID, loopID) ON DELETE CASCADE
@@ -77,3 +101,35 @@ CREATE TABLE IF NOT EXISTS bridge_rel_routes_custom (
     FOREIGN KEY (cldID, relationshipID) REFERENCES relationships_custom(cldID, relationshipID) ON DELETE CASCADE,
     FOREIGN KEY (cldID, routeID) REFERENCES routes_custom(cldID, routeID) ON DELETE CASCADE
 );
+
+-- Summary tables, rewritten by LoadAnalyses at every import so that the
+-- Explore pages read a handful of pre-aggregated rows
+
+CREATE TABLE IF NOT EXISTS loop_length_summary_custom (
+    cldID INT NOT NULL,
+    loop_length INT NOT NULL,
+    state VARCHAR(32) NOT NULL,
+    number_of_loops INT NOT NULL,
+    PRIMARY KEY (cldID, loop_length, state),
+    FOREIGN KEY (cldID) REFERENCES nodes_custom(cldID) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS node_loop_summary_custom (
+    cldID INT NOT NULL,
+    node_name VARCHAR(255) NOT NULL,
+    balancing_loops INT NOT NULL,
+    reinforcing_loops INT NOT NULL,
+    PRIMARY KEY (cldID, node_name),
+    FOREIGN KEY (cldID) REFERENCES nodes_custom(cldID) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS route_summary_custom (
+    cldID INT NOT NULL,
+    start_node VARCHAR(255) NOT NULL,
+    end_node VARCHAR(255) NOT NULL,
+    state VARCHAR(32) NOT NULL,
+    route_length INT NOT NULL,
+    number_of_routes INT NOT NULL,
+    PRIMARY KEY (cldID, start_node, end_node, state, route_length),
+    FOREIGN KEY (cldID) REFERENCES nodes_custom(cldID) ON DELETE CASCADE
+);
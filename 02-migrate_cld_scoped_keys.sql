@@ -0,0 +1,100 @@
+-- Brings custom tables created by an earlier 01-init_custom_tables.sql to the
+-- per-diagram keys: rows of different diagrams are told apart by cldID, and
+-- the filter indexes lead with it.
+-- Every step checks the current schema first, so the script can be run more
+-- than once and does nothing on a database created by the current
+-- 01-init_custom_tables.sql.
+-- Run it as root (the app user has no ALTER privilege), then run
+-- 01-init_custom_tables.sql again to create the tables it adds.
+USE cld;
+
+DROP PROCEDURE IF EXISTS migrate_cld_scoped_keys;
+
+DELIMITER //
+
+CREATE PROCEDURE migrate_cld_scoped_keys()
+BEGIN
+    -- relationships_custom: Neo4j relationship ids are unique only within one diagram's lifetime
+    IF (SELECT COUNT(*) FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'relationships_custom'
+            AND CONSTRAINT_NAME = 'PRIMARY') = 1 THEN
+        ALTER TABLE relationships_custom
+            DROP PRIMARY KEY,
+            ADD PRIMARY KEY (cldID, relationshipID);
+    END IF;
+
+    -- routes_custom: TEXT columns cannot be indexed without a prefix length
+    IF EXISTS (SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'routes_custom'
+            AND COLUMN_NAME IN ('start_node', 'end_node', 'state') AND DATA_TYPE = 'text') THEN
+        ALTER TABLE routes_custom
+            MODIFY start_node VARCHAR(255),
+            MODIFY end_node VARCHAR(255),
+            MODIFY state VARCHAR(32);
+    END IF;
+
+    -- Route filter form: diagram, start/end variable, then length and state
+    IF EXISTS (SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'routes_custom'
+            AND INDEX_NAME = 'idx_routes_custom_endpoints'
+            AND SEQ_IN_INDEX = 1 AND COLUMN_NAME <> 'cldID') THEN
+        ALTER TABLE routes_custom DROP INDEX idx_routes_custom_endpoints;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'routes_custom'
+            AND INDEX_NAME = 'idx_routes_custom_endpoints') THEN
+        ALTER TABLE routes_custom
+            ADD INDEX idx_routes_custom_endpoints (cldID, start_node, end_node, route_length, state);
+    END IF;
+
+    -- loops_custom: indexable state column
+    IF EXISTS (SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'loops_custom'
+            AND COLUMN_NAME = 'state' AND DATA_TYPE = 'text') THEN
+        ALTER TABLE loops_custom MODIFY state VARCHAR(32);
+    END IF;
+
+    -- Loop filter form: diagram, then state and/or length.
+    -- The loopID index is covered by the primary key (cldID, loopID)
+    IF EXISTS (SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'loops_custom'
+            AND INDEX_NAME = 'idx_loops_custom_loop') THEN
+        ALTER TABLE loops_custom DROP INDEX idx_loops_custom_loop;
+    END IF;
+    IF EXISTS (SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'loops_custom'
+            AND INDEX_NAME = 'idx_loops_custom_state_length'
+            AND SEQ_IN_INDEX = 1 AND COLUMN_NAME <> 'cldID') THEN
+        ALTER TABLE loops_custom DROP INDEX idx_loops_custom_state_length;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'loops_custom'
+            AND INDEX_NAME = 'idx_loops_custom_state_length') THEN
+        ALTER TABLE loops_custom
+            ADD INDEX idx_loops_custom_state_length (cldID, state, loop_length);
+    END IF;
+    IF EXISTS (SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'loops_custom'
+            AND INDEX_NAME = 'idx_loops_custom_length'
+            AND SEQ_IN_INDEX = 1 AND COLUMN_NAME <> 'cldID') THEN
+        ALTER TABLE loops_custom DROP INDEX idx_loops_custom_length;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'loops_custom'
+            AND INDEX_NAME = 'idx_loops_custom_length') THEN
+        ALTER TABLE loops_custom
+            ADD INDEX idx_loops_custom_length (cldID, loop_length);
+    END IF;
+
+    -- bridge_nodes_loops_custom: the primary key (cldID, node_name, loopID) serves the variable filter
+    IF EXISTS (SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'bridge_nodes_loops_custom'
+            AND INDEX_NAME = 'idx_bridge_nodes_loops_custom_node') THEN
+        ALTER TABLE bridge_nodes_loops_custom DROP INDEX idx_bridge_nodes_loops_custom_node;
+    END IF;
+END //
+
+DELIMITER ;
+
+CALL migrate_cld_scoped_keys();
+DROP PROCEDURE migrate_cld_scoped_keys;
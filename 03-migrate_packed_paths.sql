@@ -0,0 +1,51 @@
+-- Brings custom tables created by an earlier 01-init_custom_tables.sql to the
+-- packed loop and route paths (see cld-explorer/path_codec.py): nodes_custom
+-- gains the Loopy nodeID, and the loop_path / route text columns are replaced
+-- by loop_code / route_code.
+-- The stored text paths cannot be encoded without the Loopy node ids, so the
+-- custom rows are removed; they are rewritten by the next import of each
+-- diagram. The sample CLD tables are not touched.
+-- Every step checks the current schema first, so the script can be run more
+-- than once and does nothing on a database created by the current
+-- 01-init_custom_tables.sql. Run it as root, after 02-migrate_cld_scoped_keys.sql.
+USE cld;
+
+DROP PROCEDURE IF EXISTS migrate_packed_paths;
+
+DELIMITER //
+
+CREATE PROCEDURE migrate_packed_paths()
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'nodes_custom'
+            AND COLUMN_NAME = 'nodeID') THEN
+        -- cascades to every custom table through the cldID foreign keys
+        DELETE FROM nodes_custom;
+        ALTER TABLE nodes_custom
+            ADD COLUMN nodeID INT NOT NULL AFTER cldID,
+            ADD UNIQUE KEY uq_nodes_custom_id (cldID, nodeID);
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'loops_custom'
+            AND COLUMN_NAME = 'loop_path') THEN
+        DELETE FROM loops_custom;
+        ALTER TABLE loops_custom
+            DROP COLUMN loop_path,
+            ADD COLUMN loop_code VARBINARY(1024) AFTER loopID;
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'routes_custom'
+            AND COLUMN_NAME = 'route') THEN
+        DELETE FROM routes_custom;
+        ALTER TABLE routes_custom
+            DROP COLUMN route,
+            ADD COLUMN route_code VARBINARY(1024) AFTER end_node;
+    END IF;
+END //
+
+DELIMITER ;
+
+CALL migrate_packed_paths();
+DROP PROCEDURE migrate_packed_paths;
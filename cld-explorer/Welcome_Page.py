@@ -11,9 +11,10 @@ if DEBUG:
     # debugpy.wait_for_client()  # Optional: wait for VSCode debugger to attach
 import shutil
 
-import cairosvg
+import report_builder
 import streamlit as st
 import streamlit.components.v1 as components
+from svg_cache import svg_data_uri
 
 st.set_page_config(page_title="CLD-Explorer", layout="wide")
 
@@ -51,9 +52,10 @@ output_folder = "output"
 clear_images_in_folders(output_folder)
 
 
-def convert_svg_to_png(svg_content):
-    png_data = cairosvg.svg2png(bytestring=svg_content.encode("utf-8"))
-    return png_data
+# PNG scaricabile del CLD, dalla cache dei PNG dei report (la conversione avviene una sola volta)
+def convert_svg_to_png(svg_path):
+    with open(report_builder.convert_svg_to_png(svg_path), "rb") as png_file:
+        return png_file.read()
 
 
 def img_to_base64(file_path):
@@ -333,10 +335,8 @@ st.write("Below there are the CLDs that you can analyze:")
 
 
 # Funzione per visualizzare SVG con zoom e pan
-def display_svg_with_zoom_pan(svg_content):
-    svg_encoded = (
-        f"data:image/svg+xml;base64,{base64.b64encode(svg_content.encode()).decode()}"
-    )
+def display_svg_with_zoom_pan(svg_path):
+    svg_encoded = svg_data_uri(svg_path)
     st.markdown(
         f"""
         <style>
@@ -420,9 +420,9 @@ def display_svg_with_zoom_pan(svg_content):
 
 
 # inserimento di immagini SVG
-svg_file_1 = open("./assets/graph_covid.svg", "r").read()
-svg_file_2 = open("./assets/graph_fashion.svg", "r").read()
-svg_file_3 = open("./assets/graph_hotel.svg", "r").read()
+svg_file_1 = "./assets/graph_covid.svg"
+svg_file_2 = "./assets/graph_fashion.svg"
+svg_file_3 = "./assets/graph_hotel.svg"
 
 st.markdown("<h4>Covid-19</h4>", unsafe_allow_html=True)
 display_svg_with_zoom_pan(svg_file_1)
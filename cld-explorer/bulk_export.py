@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from uuid import uuid4
+
+from fpdf import FPDF
+
+from graph_renderer import RENDER_WORKERS, LazyGraphSequence, cached_svg_path
+from report_builder import convert_svg_to_png
+
+#cartella degli export generati (uno per sessione, il precedente viene cancellato dalla pagina)
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join("output", "exports"))
+
+#età massima degli export: quelli delle sessioni chiuse non vengono mai cancellati dalla pagina
+EXPORT_MAX_AGE_HOURS = float(os.getenv("EXPORT_MAX_AGE_HOURS", "24"))
+
+#fpdf tiene in memoria le immagini fino alla scrittura del file: il PDF ha un numero massimo di pagine
+EXPORT_PDF_MAX_PAGES = int(os.getenv("EXPORT_PDF_MAX_PAGES", "1000"))
+
+EXPORT_FORMATS = ("ZIP of SVG files", "Multi-page PDF")
+
+
+#renderizza tutti i grafi della sequenza sul pool di worker e restituisce, nell'ordine, (nome, risultato di
+#convert). Al più 2 * workers grafi sono in lavorazione o in attesa di essere scritti, quindi la memoria
+#resta limitata qualunque sia il numero di loop o route
+def iter_rendered(images, convert, workers=None):
+    workers = workers or RENDER_WORKERS
+
+    #una lista di SVG già renderizzati (generate_graphs con lazy=False)
+    if not isinstance(images, LazyGraphSequence):
+        for svg_path in images:
+            yield os.path.basename(svg_path), convert(svg_path)
+        return
+
+    def render(spec):
+        return convert(cached_svg_path(images.build_graph(spec)))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for spec in images.render_specs:
+            name = f"{os.path.basename(spec['file_name'])}.svg"
+            pending.append((name, executor.submit(render, spec)))
+            if len(pending) >= 2 * workers:
+                name, future = pending.popleft()
+                yield name, future.result()
+        while pending:
+            name, future = pending.popleft()
+            yield name, future.result()
+
+
+#cancella gli export (e le cartelle temporanee rimaste da export interrotti) più vecchi di EXPORT_MAX_AGE_HOURS
+def sweep_old_exports(max_age_hours=EXPORT_MAX_AGE_HOURS):
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    cutoff = time.time() - max_age_hours * 3600
+    for entry in os.scandir(EXPORT_DIR):
+        try:
+            if entry.stat().st_mtime >= cutoff:
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.unlink(entry.path)
+        except FileNotFoundError:
+            pass  #già cancellato da un'altra sessione
+
+
+def _read_svg(svg_path):
+    with open(svg_path, "rb") as svg_file:
+        return svg_file.read()
+
+
+#scrive tutti i grafi in uno ZIP di SVG; progress(fatti, totale) viene chiamata dopo ogni grafo
+def export_zip(images, prefix, progress=None, workers=None):
+    sweep_old_exports()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    export_path = os.path.join(EXPORT_DIR, f"{prefix}_{uuid4().hex}.zip")
+    with zipfile.ZipFile(export_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for done, (name, svg) in enumerate(iter_rendered(images, _read_svg, workers), start=1):
+            archive.writestr(name, svg)
+            if progress:
+                progress(done, len(images))
+    return export_path
+
+
+#scrive i grafi in un PDF con un grafo per pagina (al più EXPORT_PDF_MAX_PAGES).
+#I PNG vanno in una cartella temporanea cancellata dopo la scrittura del PDF: un export non riempie
+#la cache PNG dei report
+def export_pdf(images, prefix, title, progress=None, workers=None):
+    total = min(len(images), EXPORT_PDF_MAX_PAGES)
+    if isinstance(images, LazyGraphSequence):
+        images = LazyGraphSequence(images.render_specs[:total], images.build_graph, images.save_dot)
+    else:
+        images = images[:total]
+
+    sweep_old_exports()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    export_path = os.path.join(EXPORT_DIR, f"{prefix}_{uuid4().hex}.pdf")
+    with tempfile.TemporaryDirectory(dir=EXPORT_DIR) as png_dir:
+        convert = partial(convert_svg_to_png, cache_dir=png_dir)
+        pdf = FPDF()
+        pdf.set_auto_page_break(auto=True, margin=15)
+        for done, (name, png_path) in enumerate(iter_rendered(images, convert, workers), start=1):
+            pdf.add_page()
+            pdf.set_font("Arial", "B", 14)
+            pdf.cell(200, 10, txt=f"{title} {done} of {total}", ln=True, align="C")
+            pdf.set_font("Arial", size=10)
+            pdf.cell(200, 10, txt=name, ln=True, align="C")
+            if png_path:
+                pdf.image(png_path, x=(210 - 170) // 2, w=170)
+            else:
+                pdf.cell(200, 10, txt="Unable to render this image.", ln=True)
+            if progress:
+                progress(done, total)
+
+        pdf.output(export_path)
+    return export_path
@@ -1,8 +1,9 @@
-import mysql.connector
-from mysql.connector import Error
+import os
+import threading
+import time
 
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, pooling
 
 db_config = {
     # 'host': 'mysql',
@@ -13,12 +14,102 @@ db_config = {
     "database": "cld",
 }
 
+neo4j_config = {
+    "url": "bolt://neo4j:7687",
+    "user": "neo4j",
+    "password": "password",
+}
+
+
+# Pool shared by every page and session of the Streamlit process
+pool_config = {
+    "pool_name": "cld_pool",
+    "pool_size": int(os.getenv("MYSQL_POOL_SIZE", "10")),
+    "pool_reset_session": True,
+}
+# Max seconds to wait when every pooled connection is in use
+POOL_ACQUISITION_TIMEOUT = float(os.getenv("MYSQL_POOL_TIMEOUT", "10"))
+
+_pool = None
+_pool_lock = threading.Lock()
+pool_metrics = {
+    "connections_acquired": 0,
+    "reconnections": 0,
+    "exhausted_waits": 0,
+    "errors": 0,
+}
+
+
+def _count(metric):
+    with _pool_lock:
+        pool_metrics[metric] += 1
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = pooling.MySQLConnectionPool(**pool_config, **db_config)
+        return _pool
+
 
 def get_connection():
+    """
+    Return a connection from the shared pool; close() gives it back to the pool.
+
+    The connection is health-checked (and reconnected if the server dropped
+    it) before being returned. Returns None if MySQL cannot be reached.
+    """
+    deadline = time.monotonic() + POOL_ACQUISITION_TIMEOUT
+    while True:
+        try:
+            connection = _get_pool().get_connection()
+        except pooling.PoolError:
+            # Pool exhausted: wait for another session to give a connection back
+            if time.monotonic() >= deadline:
+                _count("errors")
+                print("Error connecting to MySQL: connection pool exhausted")
+                return None
+            _count("exhausted_waits")
+            time.sleep(0.05)
+            continue
+        except Error as e:
+            _count("errors")
+            print(f"Error connecting to MySQL: {e}")
+            return None
+
+        try:
+            if not connection.is_connected():
+                connection.reconnect(attempts=2, delay=0)
+                _count("reconnections")
+        except Error as e:
+            _count("errors")
+            print(f"Error connecting to MySQL: {e}")
+            connection.close()
+            return None
+
+        _count("connections_acquired")
+        return connection
+
+
+def check_health():
+    """Ping MySQL through the pool; returns True if the server answers."""
+    connection = get_connection()
+    if connection is None:
+        return False
     try:
-        connection = mysql.connector.connect(**db_config)
-        if connection.is_connected():
-            return connection
-    except Error as e:
-        print(f"Error connecting to MySQL: {e}")
-        return None
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
+        return True
+    except Error:
+        return False
+    finally:
+        connection.close()
+
+
+def get_pool_metrics():
+    """Pool settings and usage counters."""
+    with _pool_lock:
+        return {"pool_size": pool_config["pool_size"], **pool_metrics}
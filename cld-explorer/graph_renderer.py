@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+
+#numero di worker di default: ogni render di Graphviz gira in un sottoprocesso, quindi bastano i thread
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+#backend di disegno: "native" scrive l'SVG direttamente (svg_renderer), "graphviz" usa dot
+RENDER_BACKEND = os.getenv("RENDER_BACKEND", "native")
+
+#cache persistente degli SVG, fuori dalle cartelle main/compare che vengono svuotate all'avvio
+RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", os.path.join("output", "render_cache"))
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_MB", "200")) * 1024 * 1024
+
+_cache_lock = threading.Lock()
+_cache_size = None  #dimensione corrente della cache in byte, calcolata al primo uso
+
+
+#chiave della cache: hash del contenuto del grafo. Il sorgente dot contiene già percorso, nodi con
+#le posizioni, tipi di relazione e delay (stile ed etichette degli archi) e i parametri di stile;
+#il commento (che contiene l'indice nel carosello) viene escluso perché non cambia il disegno
+def render_cache_key(dot):
+    content = [dot.engine, dot.graph_attr, dot.node_attr, dot.edge_attr, dot.body]
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+#renderizza un singolo grafo in SVG e restituisce il percorso del file
+def render_graph(dot, file_name, save_dot=False, use_cache=True):
+    if save_dot:
+        #comportamento originale: salva il .dot e lascia a graphviz la scrittura dell'SVG
+        dot.save(f'{file_name}.dot')
+        dot.render(file_name, format='svg')
+        return f'{file_name}.svg'
+
+    if not use_cache:
+        #nessun file intermedio: l'SVG arriva da stdout di dot
+        with open(f'{file_name}.svg', 'wb') as svg_file:
+            svg_file.write(dot.pipe(format='svg'))
+        return f'{file_name}.svg'
+
+    #il file del carosello è un hard link alla copia in cache: l'eviction non tocca le immagini già salvate nel report
+    try:
+        _link_or_copy(cached_svg_path(dot), f'{file_name}.svg')
+    except FileNotFoundError:
+        #la copia in cache è stata eliminata da un'altra sessione prima del link: si scrive l'SVG direttamente
+        with open(f'{file_name}.svg', 'wb') as svg_file:
+            svg_file.write(dot.pipe(format='svg'))
+    return f'{file_name}.svg'
+
+
+#restituisce il percorso dell'SVG del grafo nella cache, renderizzandolo solo se manca
+def cached_svg_path(dot):
+    cached_path = os.path.join(RENDER_CACHE_DIR, f'{render_cache_key(dot)}.svg')
+    try:
+        os.utime(cached_path)  #segna l'elemento come usato di recente per l'LRU
+        return cached_path
+    except FileNotFoundError:
+        pass  #mai renderizzato o eliminato dall'eviction di un'altra sessione
+
+    os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+    svg = dot.pipe(format='svg')
+    tmp_path = f'{cached_path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as svg_file:
+        svg_file.write(svg)
+    os.replace(tmp_path, cached_path)  #scrittura atomica, sicura tra sessioni concorrenti
+    _account_cache_growth(len(svg))
+    return cached_path
+
+
+def _link_or_copy(source, destination):
+    if os.path.exists(destination):
+        os.unlink(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def _account_cache_growth(added_bytes):
+    global _cache_size
+    with _cache_lock:
+        if _cache_size is None:
+            _cache_size = sum(entry.stat().st_size for entry in os.scandir(RENDER_CACHE_DIR) if entry.name.endswith('.svg'))
+        else:
+            _cache_size += added_bytes
+        if _cache_size > RENDER_CACHE_MAX_BYTES:
+            _cache_size = _evict_least_recently_used(RENDER_CACHE_MAX_BYTES * 0.8)
+
+
+#elimina i file usati meno di recente finché la cache non scende sotto target_bytes
+#(usata anche dalla cache dei PNG dei report, vedi report_builder)
+def _evict_least_recently_used(target_bytes, directory=RENDER_CACHE_DIR, suffix='.svg'):
+    entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in os.scandir(directory) if entry.name.endswith(suffix)]
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= target_bytes:
+            break
+        try:
+            os.unlink(path)
+            total -= size
+        except FileNotFoundError:
+            pass
+    return total
+
+
+#renderizza una lista di (dot, file_name) in parallelo, mantenendo l'ordine di input
+def render_graphs(jobs, workers=None, save_dot=False):
+    workers = workers or RENDER_WORKERS
+    if workers <= 1 or len(jobs) <= 1:
+        return [render_graph(dot, file_name, save_dot) for dot, file_name in jobs]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        #map restituisce i risultati nell'ordine dei job e termina quando sono tutti completati
+        return list(executor.map(lambda job: render_graph(job[0], job[1], save_dot), jobs))
+
+
+#pool condiviso per i render on-demand e il prefetch dei caroselli
+_lazy_executor = None
+_lazy_executor_lock = threading.Lock()
+
+
+def _get_lazy_executor():
+    global _lazy_executor
+    with _lazy_executor_lock:
+        if _lazy_executor is None:
+            _lazy_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS)
+        return _lazy_executor
+
+
+#sequenza indicizzabile di grafi: l'SVG di un elemento viene prodotto solo quando viene letto.
+#images[i] restituisce il percorso del file SVG come una normale lista di file generati.
+class LazyGraphSequence(Sequence):
+    def __init__(self, render_specs, build_graph, save_dot=False):
+        self.render_specs = render_specs  #una specifica per grafo: nodi, archi, stato e nome file
+        self.build_graph = build_graph  #funzione che costruisce il Digraph da una specifica
+        self.save_dot = save_dot
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.render_specs)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        return self._submit(index).result()
+
+    #avvia in background il render degli elementi vicini a index (successivo e precedente)
+    def prefetch(self, index, radius=1):
+        if not self.render_specs:
+            return
+        for offset in range(1, radius + 1):
+            self._submit((index + offset) % len(self))
+            self._submit((index - offset) % len(self))
+
+    def is_rendered(self, index):
+        future = self._futures.get(index)
+        return future is not None and future.done()
+
+    def _submit(self, index):
+        spec = self.render_specs[index]  #solleva IndexError come una lista
+        with self._lock:
+            future = self._futures.get(index)
+            #un render fallito (es. errore di dot) non resta in memoria: alla lettura successiva si riprova
+            if future is not None and future.done() and (future.cancelled() or future.exception() is not None):
+                future = None
+            if future is None:
+                future = _get_lazy_executor().submit(self._render, spec)
+                self._futures[index] = future
+            return future
+
+    def _render(self, spec):
+        return render_graph(self.build_graph(spec), spec['file_name'], self.save_dot)
+
+    def __repr__(self):
+        rendered = sum(1 for future in self._futures.values() if future.done())
+        return f"LazyGraphSequence({len(self)} graphs, {rendered} rendered)"
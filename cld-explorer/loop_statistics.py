@@ -0,0 +1,137 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+from db_config import get_connection
+from query_builder import LOOP_SUMMARY_TABLES
+
+#range di lunghezza mostrati nella panoramica, nell'ordine di visualizzazione
+LENGTH_RANGES = ['length<=5', '5<length<=10', '10<length<=15', '15<length<=20', '20<length<=25', 'k>25']
+
+#bucket dei range di lunghezza, nello stesso ordine di LENGTH_RANGES
+_LENGTH_RANGE = """CASE
+            WHEN {length} <= 5 THEN 'length<=5'
+            WHEN {length} BETWEEN 6 AND 10 THEN '5<length<=10'
+            WHEN {length} BETWEEN 11 AND 15 THEN '10<length<=15'
+            WHEN {length} BETWEEN 16 AND 20 THEN '15<length<=20'
+            WHEN {length} BETWEEN 21 AND 25 THEN '20<length<=25'
+            ELSE 'k>25'
+        END"""
+
+#cache per CLD (chiave: tabella dei loop e cldID), condivisa da tutte le sessioni del processo.
+#Ogni sessione ha il suo cldID: la cache tiene solo i STATS_CACHE_SIZE CLD usati più di recente
+STATS_CACHE_SIZE = int(os.getenv("STATS_CACHE_SIZE", "128"))
+_stats_cache = OrderedDict()
+_stats_lock = threading.Lock()
+
+
+#funzione che calcola tutte le metriche della panoramica dei loop con un'unica query
+#cld_id limita le metriche a un diagramma custom (vedi query_builder.session_cld_id)
+def get_loop_statistics(table_name, cld_id=None):
+    key = (table_name, cld_id)
+    with _stats_lock:
+        if key in _stats_cache:
+            _stats_cache.move_to_end(key)
+            return _stats_cache[key]
+
+    scope = "WHERE cldID = %s" if cld_id is not None else ""
+    params = [cld_id] * 3 if cld_id is not None else []
+
+    if table_name in LOOP_SUMMARY_TABLES:
+        query = _summary_query(table_name, scope)
+    else:
+        query = _aggregate_query(table_name, scope)
+
+    conn = get_connection()
+    if conn is None:
+        return _empty_statistics()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+
+    stats = _build_statistics(rows)
+    with _stats_lock:
+        _stats_cache[key] = stats
+        while len(_stats_cache) > STATS_CACHE_SIZE:
+            _stats_cache.popitem(last=False)
+    return stats
+
+
+#stessi conteggi letti dalle tabelle riassuntive scritte all'import (poche righe per CLD)
+def _summary_query(table_name, scope):
+    length_summary, node_summary = LOOP_SUMMARY_TABLES[table_name]
+    return f"""
+    SELECT 'state' AS metric, s.state AS name, SUM(s.number_of_loops) AS value
+    FROM {length_summary} AS s
+    {scope}
+    GROUP BY s.state
+    UNION ALL
+    SELECT 'length_range' AS metric, {_LENGTH_RANGE.format(length='s.loop_length')} AS name,
+        SUM(s.number_of_loops) AS value
+    FROM {length_summary} AS s
+    {scope}
+    GROUP BY name
+    UNION ALL
+    SELECT 'node' AS metric, n.node_name AS name, n.balancing_loops + n.reinforcing_loops AS value
+    FROM {node_summary} AS n
+    {scope};
+    """
+
+
+#un solo round trip: conteggi per stato, per range di lunghezza e per variabile
+def _aggregate_query(table_name, scope):
+    return f"""
+    SELECT 'state' AS metric, l.state AS name, COUNT(*) AS value
+    FROM {table_name} AS l
+    {scope}
+    GROUP BY l.state
+    UNION ALL
+    SELECT 'length_range' AS metric, {_LENGTH_RANGE.format(length='l.loop_length')} AS name,
+        COUNT(*) AS value
+    FROM {table_name} AS l
+    {scope}
+    GROUP BY name
+    UNION ALL
+    SELECT 'node' AS metric, b.node_name AS name, COUNT(*) AS value
+    FROM bridge_nodes_{table_name} AS b
+    {scope}
+    GROUP BY b.node_name;
+    """
+
+
+#da chiamare quando i loop di un CLD vengono ricaricati
+def invalidate_loop_statistics(table_name=None, cld_id=None):
+    with _stats_lock:
+        if table_name is None:
+            _stats_cache.clear()
+        else:
+            _stats_cache.pop((table_name, cld_id), None)
+
+
+def _build_statistics(rows):
+    states = {name: int(value) for metric, name, value in rows if metric == 'state'}
+    lengths = {name: int(value) for metric, name, value in rows if metric == 'length_range'}
+    nodes = sorted(
+        ((name, int(value)) for metric, name, value in rows if metric == 'node'),
+        key=lambda x: x[0].lower(),
+    )
+
+    return {
+        'total_loops': sum(states.values()),
+        'balancing_loops': states.get('balancing', 0),
+        'reinforcing_loops': states.get('reinforcing', 0),
+        'loop_length_df': pd.DataFrame(
+            [(r, lengths[r]) for r in LENGTH_RANGES if r in lengths],
+            columns=['length_range', 'number_of_loops'],
+        ),
+        'node_loop_df': pd.DataFrame(nodes, columns=['variable_name', 'number_of_loops']),
+    }
+
+
+def _empty_statistics():
+    return _build_statistics([])
@@ -0,0 +1,227 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from models.causal_loop_diagram import (
+    AnalyzeCLDGraph,
+    LoadAnalyses,
+    invalidate_extractions,
+)
+from models.loopy import Loopy, LoopyNeo4jLoader
+
+# Stages of the Load pipeline. After the import, LoadAnalyses.load_all runs
+# them concurrently: the routes are streamed into MySQL while the loops are
+# extracted and persisted.
+STAGES = ("import", "loops", "persist", "routes")
+
+# Analyses running at the same time across all sessions of the process
+JOB_WORKERS = int(os.getenv("ANALYSIS_JOB_WORKERS", "2"))
+
+# Finished jobs are kept for polling for this many seconds
+JOB_RETENTION = float(os.getenv("ANALYSIS_JOB_RETENTION", "3600"))
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS)
+_jobs = {}
+_lock = threading.Lock()
+
+# Version of the diagram whose analyses are stored in MySQL, by session. Only
+# set by a job that completed, so a later edit can be applied incrementally;
+# after a restart or a failed job the next load starts from scratch.
+_loaded_versions = {}
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when its cancellation has been requested."""
+
+
+class AnalysisJob:
+    def __init__(self, session_id, loopy_url: str, neo4j_conf: dict, mysql_conf: dict):
+        """
+        Args:
+            session_id: id of the session, used as diagram uuid in Neo4j and
+                to derive the cldID of the *_custom rows
+            loopy_url (str): link exported from Loopy
+            neo4j_conf (dict): url, user and password of Neo4j
+            mysql_conf (dict): host, port, user and password of MySQL
+        """
+        self.id = uuid4().hex
+        self.session_id = session_id
+        self.loopy_url = loopy_url
+        self.neo4j_conf = neo4j_conf
+        self.mysql_conf = mysql_conf
+
+        self.status = "queued"  # queued, running, done, failed, cancelled
+        self.completed = []
+        self.error = None
+        self.timings = {}
+        self.result = {}
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._previous = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    @property
+    def stage(self):
+        """First stage not completed yet, None once all of them are."""
+        return next((stage for stage in STAGES if stage not in self.completed), None)
+
+    @property
+    def progress(self) -> float:
+        """Fraction of the stages completed, between 0 and 1."""
+        return len(self.completed) / len(STAGES)
+
+    def cancel(self):
+        """Request cancellation; the job stops at the next checkpoint."""
+        self._cancel.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def run(self):
+        # A previous job of the same session writes the same rows: let it stop first
+        if self._previous is not None:
+            self._previous.wait()
+            self._previous = None
+
+        self.status = "running"
+        try:
+            self._run_stages()
+            self.status = "done"
+        except JobCancelled:
+            self.status = "cancelled"
+        except Exception as e:
+            self.error = str(e)
+            self.status = "failed"
+        finally:
+            self.finished_at = time.time()
+            self._done.set()
+
+    def _complete_stage(self, stage: str):
+        self.completed.append(stage)
+
+    def _run_stages(self):
+        neo4j = (
+            self.neo4j_conf["url"],
+            self.neo4j_conf["user"],
+            self.neo4j_conf["password"],
+        )
+
+        self.check_cancelled()
+        start = time.perf_counter()
+        loopy = Loopy(self.loopy_url)
+        loopy.load()
+        importer = LoopyNeo4jLoader(self.session_id)
+        importer.set_database_conf(*neo4j)
+        self.result["loopy"] = loopy
+        self.result["version"] = loopy.version
+
+        # the stored analyses are discarded as soon as the graph starts to change
+        loaded_version = _loaded_versions.pop(self.session_id, None)
+        if loaded_version == loopy.version:
+            # same diagram as the last completed load: nothing to recompute
+            self.result["import_timings"] = {}
+            self.result["cld_id"] = LoadAnalyses(self.session_id).cld_id
+            self.result["routes"] = None
+            self.timings["import"] = time.perf_counter() - start
+            self.completed.extend(STAGES)
+            _loaded_versions[self.session_id] = loopy.version
+            return
+
+        diff = None
+        if loaded_version is not None:
+            diff = importer.sync(loopy)
+        else:
+            importer.load(loopy)
+        self.result["import_timings"] = importer.timings
+        # relationship ids change with the import: earlier extractions are stale
+        invalidate_extractions(self.session_id)
+        self.timings["import"] = time.perf_counter() - start
+        self._complete_stage("import")
+
+        self.check_cancelled()
+        analyzer = AnalyzeCLDGraph(self.session_id, version=loopy.version)
+        analyzer.set_database_conf(*neo4j)
+        loader = LoadAnalyses(self.session_id)
+        loader.set_database_conf(
+            self.mysql_conf["host"] + ":" + self.mysql_conf["port"],
+            self.mysql_conf["user"],
+            self.mysql_conf["password"],
+        )
+        # diagrams of ended sessions are never replaced: drop the expired ones
+        loader.purge_expired()
+        if diff is None:
+            timings = loader.load_all(
+                analyzer,
+                checkpoint=self.check_cancelled,
+                on_stage_done=self._complete_stage,
+            )
+        else:
+            timings = loader.load_incremental(
+                analyzer,
+                diff,
+                checkpoint=self.check_cancelled,
+                on_stage_done=self._complete_stage,
+            )
+        self.timings.update(timings)
+        self.result["cld_id"] = loader.cld_id
+        self.result["routes"] = loader.routes_written
+        _loaded_versions[self.session_id] = loopy.version
+
+    def __repr__(self):
+        return f"AnalysisJob({self.id}, {self.status}, stage={self.stage})"
+
+
+def submit_job(session_id, loopy_url: str, neo4j_conf: dict, mysql_conf: dict):
+    """
+    Queue the Load pipeline of a diagram on the shared worker pool.
+
+    An unfinished job of the same session is cancelled; the new one starts
+    after it has stopped.
+
+    Returns:
+        AnalysisJob: the queued job, to be polled with get_job(job.id)
+    """
+    job = AnalysisJob(session_id, loopy_url, neo4j_conf, mysql_conf)
+    with _lock:
+        _prune_finished()
+        for other in _jobs.values():
+            if other.session_id == session_id and not other.finished:
+                other.cancel()
+                job._previous = other
+        _jobs[job.id] = job
+    _executor.submit(job.run)
+    return job
+
+
+def get_job(job_id: str):
+    """Return the job with the given id, or None if unknown or expired."""
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def cancel_job(job_id: str):
+    job = get_job(job_id)
+    if job is not None:
+        job.cancel()
+
+
+def _prune_finished():
+    now = time.time()
+    for job_id in [
+        job_id
+        for job_id, job in _jobs.items()
+        if job.finished and now - job.finished_at > JOB_RETENTION
+    ]:
+        del _jobs[job_id]
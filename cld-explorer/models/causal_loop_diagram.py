@@ -1,27 +1,144 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid4
 
 import pandas as pd
-from neo4j import GraphDatabase
+from loop_statistics import invalidate_loop_statistics
+from path_codec import encode_path
+from query_builder import session_cld_id
 from sqlalchemy import create_engine, text
 
+from models.graph_engine import (
+    iter_routes_from_edges,
+    loops_from_edges,
+    loops_through_edges,
+    nodes_reaching_edges,
+    routes_from_edges,
+)
+from models.neo4j_driver import get_driver, pooled_session
+
+# Engines available to AnalyzeCLDGraph.extract_loops
+LOOP_ENGINES = ("native", "neo4j")
+
+# Engines available to AnalyzeCLDGraph.extract_routes and iter_routes
+ROUTE_ENGINES = ("native", "neo4j")
+
+# Rows written per executemany call by LoadAnalyses.load_routes
+ROUTES_BATCH_SIZE = int(os.getenv("ROUTES_BATCH_SIZE", "5000"))
+
+# Neo4j relationship type (as written by LoopyNeo4jLoader) -> type stored in
+# relationships_custom and in the bridge tables; other types are stored as NULL
+RELATIONSHIP_TYPES = {
+    "CONG_CHANGE": "CONC_CHANGE",
+    "CONC_CHANGE": "CONC_CHANGE",
+    "DISC_CHANGE": "DISC_CHANGE",
+}
+
+# Hours after its last load when a custom diagram is deleted by
+# LoadAnalyses.purge_expired (sessions end without notice)
+CUSTOM_CLD_TTL_HOURS = float(os.getenv("CUSTOM_CLD_TTL_HOURS", "24"))
+
+ROUTES_QUERY = """
+MATCH (startNode{uuid:$uuid}), (endNode{uuid:$uuid})
+WHERE startNode.external_id <> endNode.external_id
+CALL apoc.algo.allSimplePaths(startNode, endNode, '>', 20) YIELD path
+WITH startNode,endNode,path,relationships(path) AS rels,nodes(path) as nodePath
+WITH 
+    [x IN range(0, size(nodePath) + size(rels) - 1) |
+        CASE 
+            WHEN x % 2 = 0 THEN nodePath[x / 2].label // Indice per i nodi
+            ELSE toString(id(rels[(x - 1) / 2]))      // Indice per le relazioni
+        END
+    ] AS path_sequence,rels,
+    path,startNode,endNode
+WITH rels,path_sequence,startNode,endNode,
+path,size(rels) as pathlength,
+size([rel in rels WHERE type(rel) = 'CONC_CHANGE']) AS hopsCon,
+size([rel in rels WHERE type(rel) = 'DISC_CHANGE']) AS hopsDisc,
+       CASE
+           WHEN size([rel in rels WHERE type(rel) = 'DISC_CHANGE']) % 2 = 0 
+           THEN 'increasing'
+           ELSE 'decreasing'
+       END AS pathState
+RETURN  startNode.label AS start_node,endNode.label AS end_node, path_sequence AS route, pathlength AS route_length,pathState AS state
+"""
+
+# Extraction results shared by the process, keyed by (uuid, version, extraction)
+# and bounded to the most recently used EXTRACTION_CACHE_SIZE entries
+EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", "32"))
+_extractions = OrderedDict()
+_extractions_lock = threading.Lock()
+
+
+def invalidate_extractions(uuid=None):
+    """Drop the memoized extractions of a diagram (of all if uuid is None)."""
+    with _extractions_lock:
+        if uuid is None:
+            _extractions.clear()
+            return
+        for key in [key for key in _extractions if key[0] == str(uuid)]:
+            del _extractions[key]
+
+
+# SQLAlchemy engines (and their connection pools) shared by the process
+_engines = {}
+
+
+def _get_engine(conn_string: str):
+    if conn_string not in _engines:
+        _engines[conn_string] = create_engine(conn_string, pool_pre_ping=True)
+    return _engines[conn_string]
+
 
 class AnalyzeCLDGraph:
-    def __init__(self, uuid: uuid4 = None):
+    def __init__(
+        self,
+        uuid: uuid4 = None,
+        loop_engine: str = "native",
+        version: str = None,
+        route_engine: str = "native",
+    ):
+        """
+        Args:
+            uuid: id of the diagram imported in Neo4j
+            loop_engine (str): "native" enumerates the loops in-process from
+                the edge list (Johnson's algorithm), "neo4j" runs the
+                variable-length Cypher query on the database.
+            version (str): version of the imported diagram (Loopy.version).
+                Extraction results are memoized per uuid and version, so
+                analyzers of the same import share them; call
+                invalidate_extractions(uuid) when the diagram is re-imported.
+            route_engine (str): "native" enumerates the routes in-process with
+                one depth-first search per source over the edge list,
+                "neo4j" calls apoc.algo.allSimplePaths for every node pair.
+        """
+        if loop_engine not in LOOP_ENGINES:
+            raise ValueError(f"Unknown loop engine: {loop_engine}")
+        if route_engine not in ROUTE_ENGINES:
+            raise ValueError(f"Unknown route engine: {route_engine}")
         self.uuid = str(uuid)
-        pass
+        self.loop_engine = loop_engine
+        self.version = version
+        self.route_engine = route_engine
 
     def set_database_conf(self, url: str, user: str, password: str):
         self.url = url
         self.user = user
         self.password = password
+        self.driver = get_driver(self.url, self.user, self.password)
 
-        with GraphDatabase.driver(self.url, auth=(self.user, self.password)) as driver:
-            try:
-                self.session = driver.verify_connectivity()
-            except Exception as e:
-                raise ValueError(f"Could not connect to database: {e}")
+    def extract_loops(self, max_length: int = 20):
+        if self.loop_engine == "neo4j":
+            return self._memoized("loops:neo4j", self._extract_loops_neo4j)
+        return self._memoized(
+            f"loops:native:{max_length}",
+            lambda: loops_from_edges(self.extract_edge_list(), max_length=max_length),
+        )
 
-    def extract_loops(self):
+    def _extract_loops_neo4j(self):
         query = """
 MATCH p = (n{uuid:$uuid})-[*2..20]->(n)
 WHERE NOT apoc.coll.containsDuplicates(tail(nodes(p))) 
@@ -45,123 +162,659 @@ RETURN
                 """
         return self._run_query(query)
 
-    def extract_routes(self):
-        query = """
-MATCH (startNode{uuid:$uuid}), (endNode{uuid:$uuid})
-WHERE startNode.external_id <> endNode.external_id
-CALL apoc.algo.allSimplePaths(startNode, endNode, '>', 20) YIELD path
-WITH startNode,endNode,path,relationships(path) AS rels,nodes(path) as nodePath
-WITH 
-    [x IN range(0, size(nodePath) + size(rels) - 1) |
-        CASE 
-            WHEN x % 2 = 0 THEN nodePath[x / 2].label // Indice per i nodi
-            ELSE toString(id(rels[(x - 1) / 2]))      // Indice per le relazioni
-        END
-    ] AS path_sequence,rels,
-    path,startNode,endNode
-WITH rels,path_sequence,startNode,endNode,
-path,size(rels) as pathlength,
-size([rel in rels WHERE type(rel) = 'CONC_CHANGE']) AS hopsCon,
-size([rel in rels WHERE type(rel) = 'DISC_CHANGE']) AS hopsDisc,
-       CASE
-           WHEN size([rel in rels WHERE type(rel) = 'DISC_CHANGE']) % 2 = 0 
-           THEN 'increasing'
-           ELSE 'decreasing'
-       END AS pathState
-RETURN  startNode.label AS start_node,endNode.label AS end_node, path_sequence AS route, pathlength AS route_length,pathState AS state
-"""
-        return self._run_query(query)
+    def extract_routes(self, max_length: int = 20, max_routes_per_pair: int = None):
+        """
+        Args:
+            max_length (int): maximum number of relationships of a route
+            max_routes_per_pair (int): optional cap on the routes reported
+                for each (start, end) pair; native engine only
+        """
+        if self.route_engine == "neo4j":
+            return self._memoized("routes:neo4j", lambda: self._run_query(ROUTES_QUERY))
+        return self._memoized(
+            f"routes:native:{max_length}:{max_routes_per_pair}",
+            lambda: routes_from_edges(
+                self.extract_edge_list(), max_length, max_routes_per_pair
+            ),
+        )
+
+    def iter_routes(self, max_length: int = 20, max_routes_per_pair: int = None):
+        """
+        Stream the routes of the diagram one record at a time.
+
+        The native engine generates them lazily from the edge list. With the
+        neo4j engine the driver pulls the result from the server in
+        fetch-size batches. Either way the routes are never held in memory
+        all at once.
+        """
+        if self.route_engine == "native":
+            yield from iter_routes_from_edges(
+                self.extract_edge_list(), max_length, max_routes_per_pair
+            )
+            return
+
+        with pooled_session(self.driver) as session:
+            result = session.run(ROUTES_QUERY, uuid=self.uuid)
+            for record in result:
+                yield record
 
     def extract_nodes(self):
         query = """
     MATCH ( n { uuid: $uuid } )
-    RETURN n.label as node_name, n . x as pos_x , n . y as pos_y
+    RETURN n.external_id as nodeID, n.label as node_name, n . x as pos_x , n . y as pos_y
             """
-        return self._run_query(query)
+        return self._memoized("nodes", lambda: self._run_query(query))
 
     def extract_edges(self):
         query = """
 MATCH ( a { uuid: $uuid}) -[ r ] - >( b { uuid: $uuid})
  RETURN id(r)  as relationshipID , type ( r ) as type
  """
-        return self._run_query(query)
+        return self._memoized("edges", lambda: self._run_query(query))
+
+    def extract_edge_list(self):
+        query = """
+MATCH (a {uuid: $uuid})-[r]->(b {uuid: $uuid})
+RETURN a.external_id AS source, b.external_id AS target,
+       a.label AS source_label, b.label AS target_label,
+       id(r) AS relationshipID, type(r) AS type
+"""
+        return self._memoized("edge_list", lambda: self._run_query(query))
+
+    def _memoized(self, extraction: str, compute) -> pd.DataFrame:
+        # Callers (e.g. LoadAnalyses) add columns to the returned frames: hand out copies
+        key = (self.uuid, self.version, extraction)
+        with _extractions_lock:
+            if key in _extractions:
+                _extractions.move_to_end(key)
+                return _extractions[key].copy()
+
+        df = compute()
+        with _extractions_lock:
+            # a new version of the diagram replaces the results of the previous ones
+            for stale in [
+                k for k in _extractions if k[0] == self.uuid and k[1] != self.version
+            ]:
+                del _extractions[stale]
+            _extractions[key] = df
+            while len(_extractions) > EXTRACTION_CACHE_SIZE:
+                _extractions.popitem(last=False)
+        return df.copy()
 
     def _run_query(self, query: str) -> pd.DataFrame:
         def _tx_run_query(tx):
             result = tx.run(query, uuid=self.uuid)
             return result.to_df()
 
-        with GraphDatabase.driver(self.url, auth=(self.user, self.password)) as driver:
-            with driver.session(database="neo4j") as session:
-                data = session.execute_read(_tx_run_query)
-                return data
+        with pooled_session(self.driver) as session:
+            return session.execute_read(_tx_run_query)
 
 
 class LoadAnalyses:
     def __init__(self, uuid: uuid4 = None):
+        """
+        Args:
+            uuid: id of the diagram (the session id); every row written to
+                the *_custom tables is keyed by the cldID derived from it, so
+                concurrent sessions never overwrite each other.
+        """
         self.uuid = str(uuid)
-        pass
+        self.cld_id = session_cld_id(uuid)
 
     def set_database_conf(self, url: str, user: str, password: str):
         self.conn_string = f"mysql+mysqlconnector://{user}:{password}@{url}/cld"
+        self.engine = _get_engine(self.conn_string)
+
+    def register(self):
+        """Record that the diagram is being loaded now (see purge_expired)."""
+        with self.engine.connect() as connection:
+            connection.execute(
+                text(
+                    "INSERT INTO custom_clds (cldID, last_loaded_at) "
+                    "VALUES (:cld_id, NOW()) "
+                    "ON DUPLICATE KEY UPDATE last_loaded_at = NOW()"
+                ),
+                {"cld_id": self.cld_id},
+            )
+            connection.commit()
+
+    def purge_expired(self, ttl_hours: float = None) -> list:
+        """
+        Delete the custom diagrams not loaded for ttl_hours.
+
+        Every session writes its diagram under its own cldID, so the rows of
+        ended sessions are removed here. Deleting the nodes_custom rows
+        cascades to every other custom table. Diagrams stored before they
+        were registered in custom_clds are removed as well; the diagram of
+        this session never is.
+
+        Returns:
+            list: the cldIDs deleted
+        """
+        ttl_hours = CUSTOM_CLD_TTL_HOURS if ttl_hours is None else ttl_hours
+        params = {"cld_id": self.cld_id, "seconds": int(ttl_hours * 3600)}
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                text(
+                    "SELECT cldID FROM custom_clds "
+                    "WHERE last_loaded_at < NOW() - INTERVAL :seconds SECOND "
+                    "AND cldID <> :cld_id "
+                    "UNION "
+                    "SELECT DISTINCT cldID FROM nodes_custom "
+                    "WHERE cldID NOT IN (SELECT cldID FROM custom_clds) "
+                    "AND cldID <> :cld_id"
+                ),
+                params,
+            )
+            expired = [row[0] for row in rows]
+            # one diagram per transaction: route bridges can be large
+            for cld_id in expired:
+                for table_name in ("nodes_custom", "custom_clds"):
+                    connection.execute(
+                        text(f"DELETE FROM {table_name} WHERE cldID = :cld_id"),
+                        {"cld_id": cld_id},
+                    )
+                connection.commit()
+        for cld_id in expired:
+            invalidate_loop_statistics("loops_custom", cld_id)
+        return expired
 
     def _clear_table(self, table_name: str):
-        engine = create_engine(self.conn_string)
-        with engine.connect() as connection:
-            connection.execute(text(f"DELETE FROM {table_name};"))
+        with self.engine.connect() as connection:
+            connection.execute(
+                text(f"DELETE FROM {table_name} WHERE cldID = :cld_id;"),
+                {"cld_id": self.cld_id},
+            )
             connection.commit()
 
     def load_nodes(self, df: pd.DataFrame):
-        df["cldID"] = 99
+        df["cldID"] = self.cld_id
         self._clear_table("nodes_custom")
-        df.to_sql("nodes_custom", self.conn_string, if_exists="append", index=False)
+        df.to_sql("nodes_custom", self.engine, if_exists="append", index=False)
 
-    def load_relationships(self, df: pd.DataFrame):
-        df["cldID"] = 99
-        # TODO: Add delay and type
+    def load_relationships(self, df: pd.DataFrame, append: bool = False):
+        df["cldID"] = self.cld_id
+        # TODO: Add delay
         df["delay"] = "no"
-        df["type"] = "CONC_CHANGE"
-        self._clear_table("relationships_custom")
+        # Neo4j type of the edge, in the names used by the sample CLDs
+        df["type"] = df["type"].map(RELATIONSHIP_TYPES)
+        if not append:
+            self._clear_table("relationships_custom")
         df.to_sql(
-            "relationships_custom", self.conn_string, if_exists="append", index=False
+            "relationships_custom", self.engine, if_exists="append", index=False
         )
 
-    def load_loops(self, df: pd.DataFrame):
-        df["cldID"] = 99
-        self._clear_table("loops_custom")
-        df["loopID"] = range(1, len(df) + 1)
-        df["loop_path"] = (
-            df["loop_path"]
-            .apply(lambda x: str(x))
-            .replace(r"[\[\]]", "", regex=True)
-            .replace("'", "", regex=True)
-        )
-        df.to_sql("loops_custom", self.conn_string, if_exists="append", index=False)
+    def _next_id(self, table_name: str, id_column: str) -> int:
+        with self.engine.connect() as connection:
+            last = connection.execute(
+                text(
+                    f"SELECT MAX({id_column}) FROM {table_name} WHERE cldID = :cld_id"
+                ),
+                {"cld_id": self.cld_id},
+            ).scalar()
+        return (last or 0) + 1
+
+    def load_loops(self, df: pd.DataFrame, first_id: int = 1):
+        """
+        Loop ids start from first_id. With the default the stored loops of
+        the diagram are replaced, otherwise df is appended to them.
+        """
+        df["cldID"] = self.cld_id
+        if first_id == 1:
+            self._clear_table("loops_custom")
+        df["loopID"] = range(first_id, first_id + len(df))
+        node_ids = self._node_ids()
+        df["loop_code"] = df["loop_path"].apply(lambda x: encode_path(x, node_ids))
+        df = df.drop(columns="loop_path")
+        df.to_sql("loops_custom", self.engine, if_exists="append", index=False)
+        invalidate_loop_statistics("loops_custom", self.cld_id)
 
-    def load_nodes_loops(self, df_loops: pd.DataFrame):
+    def load_nodes_loops(self, df_loops: pd.DataFrame, first_id: int = 1):
         df_loops["node_name"] = df_loops.loop_path.apply(lambda x: x[::2])
         # print(type(df_loops.loop_path.iloc[0]))
         # print(df_loops.head())
-        df_loops["loopID"] = range(1, len(df_loops) + 1)
+        df_loops["loopID"] = range(first_id, first_id + len(df_loops))
         df_nodes_loops = df_loops.explode("node_name")
-        df_nodes_loops["cldID"] = 99
-        self._clear_table("bridge_nodes_loops_custom")
+        df_nodes_loops["cldID"] = self.cld_id
+        if first_id == 1:
+            self._clear_table("bridge_nodes_loops_custom")
         df_nodes_loops = df_nodes_loops[["node_name", "loopID", "cldID"]]
         df_nodes_loops.drop_duplicates(inplace=True)
         df_nodes_loops.to_sql(
             "bridge_nodes_loops_custom",
-            self.conn_string,
+            self.engine,
             if_exists="append",
             index=False,
         )
+        invalidate_loop_statistics("loops_custom", self.cld_id)
 
-    def load_routes(self, df: pd.DataFrame):
-        df["cldID"] = 99
-        self._clear_table("routes_custom")
-        df["routeID"] = range(1, len(df) + 1)
-        df.route = (
-            df.route.apply(lambda x: str(x))
-            .replace(r"[\[\]]", "", regex=True)
-            .replace("'", "", regex=True)
+    def load_all(
+        self, analyzer: AnalyzeCLDGraph, checkpoint=None, on_stage_done=None
+    ) -> dict:
+        """
+        Extract every analysis of the diagram and write it, overlapping the work.
+
+        Loops and edges are extracted concurrently on their own Neo4j
+        sessions while the nodes and relationships are written. The routes
+        are then streamed into MySQL while the loops are still being
+        enumerated, and the loop tables are written as soon as the loops are
+        ready. Nodes and relationships are written first because the other
+        tables, bridge tables included, reference them.
+
+        Args:
+            analyzer (AnalyzeCLDGraph): configured analyzer of the same diagram
+            checkpoint: optional callable invoked between steps and for every
+                route record; an exception raised by it aborts the load
+            on_stage_done: optional callable receiving "loops", "persist" and
+                "routes" as each of them completes
+
+        Returns:
+            dict: wall time in seconds of each stage and of the whole load
+        """
+        checkpoint = checkpoint or (lambda: None)
+        on_stage_done = on_stage_done or (lambda stage: None)
+        self.timings = {}
+        start = time.perf_counter()
+        self.register()
+
+        def timed(stage, function, *args):
+            stage_start = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                self.timings[stage] = time.perf_counter() - stage_start
+
+        def stream_routes():
+            records = analyzer.iter_routes()
+            try:
+                return self.load_routes(_checked(records, checkpoint))
+            finally:
+                records.close()
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            loops = pool.submit(timed, "extract_loops", analyzer.extract_loops)
+            edges = pool.submit(timed, "extract_edges", analyzer.extract_edges)
+            timed("nodes", lambda: self.load_nodes(analyzer.extract_nodes()))
+            timed("relationships", lambda: self.load_relationships(edges.result()))
+            checkpoint()
+
+            routes = pool.submit(timed, "routes", stream_routes)
+
+            loops = loops.result()
+            on_stage_done("loops")
+            checkpoint()
+            timed("loops", self._load_loop_tables, loops)
+            timed("loop_summaries", self.refresh_loop_summaries)
+            on_stage_done("persist")
+
+            self.routes_written = routes.result()
+            timed("route_summary", self.refresh_route_summary)
+            on_stage_done("routes")
+
+        self.timings["total"] = time.perf_counter() - start
+        return self.timings
+
+    def load_rels_loops(self, df_loops: pd.DataFrame, first_id: int = 1):
+        """
+        Write bridge_rel_loops_custom: one row per relationship of each loop,
+        with the type and delay stored in relationships_custom.
+        """
+        df_loops["relationshipID"] = df_loops.loop_path.apply(
+            lambda x: [int(step) for step in x[1::2]]
+        )
+        df_loops["loopID"] = range(first_id, first_id + len(df_loops))
+        df_rels_loops = df_loops.explode("relationshipID")
+        if first_id == 1:
+            self._clear_table("bridge_rel_loops_custom")
+        attributes = self._relationship_attributes()
+        df_rels_loops["cldID"] = self.cld_id
+        df_rels_loops["type_rel"] = df_rels_loops.relationshipID.map(
+            lambda x: attributes[x][0]
         )
-        df.to_sql("routes_custom", self.conn_string, if_exists="append", index=False)
+        df_rels_loops["delay"] = df_rels_loops.relationshipID.map(
+            lambda x: attributes[x][1]
+        )
+        df_rels_loops = df_rels_loops[
+            ["relationshipID", "loopID", "cldID", "type_rel", "delay"]
+        ]
+        df_rels_loops.to_sql(
+            "bridge_rel_loops_custom",
+            self.engine,
+            if_exists="append",
+            index=False,
+        )
+
+    def _node_ids(self) -> dict:
+        """nodeID of the stored nodes, by node_name (see path_codec)."""
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                text(
+                    "SELECT node_name, nodeID FROM nodes_custom WHERE cldID = :cld_id"
+                ),
+                {"cld_id": self.cld_id},
+            )
+            return dict(rows.fetchall())
+
+    def _relationship_attributes(self) -> dict:
+        """Type and delay of the stored relationships, by relationshipID."""
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                text(
+                    "SELECT relationshipID, type, delay FROM relationships_custom "
+                    "WHERE cldID = :cld_id"
+                ),
+                {"cld_id": self.cld_id},
+            )
+            return {rel_id: (rel_type, delay) for rel_id, rel_type, delay in rows}
+
+    def _load_loop_tables(self, loops: pd.DataFrame, first_id: int = 1):
+        nodes_loops = loops.copy(deep=True)
+        rels_loops = loops.copy(deep=True)
+        self.load_loops(loops, first_id)
+        self.load_nodes_loops(nodes_loops, first_id)
+        self.load_rels_loops(rels_loops, first_id)
+
+    def load_incremental(
+        self,
+        analyzer: AnalyzeCLDGraph,
+        diff: dict,
+        checkpoint=None,
+        on_stage_done=None,
+        max_length: int = 20,
+    ) -> dict:
+        """
+        Update the stored analyses after LoopyNeo4jLoader.sync, recomputing
+        only what the edit can have changed.
+
+        A loop or a route is stale when it uses a removed edge or an edge of
+        a relabeled node. The stale loops are deleted and the loops through
+        the added edges (and the edges of relabeled nodes) are enumerated
+        and appended. Routes are regenerated only for the start nodes that
+        can reach one of those edges, before or after the edit. All the
+        other rows stay in MySQL untouched.
+
+        Removing a node falls back to load_all: the custom tables cascade
+        from nodes_custom on cldID alone, so a single node row cannot be
+        deleted without dropping the rows of the whole diagram. So does a
+        rename to a label that another node had before the edit.
+
+        Args:
+            analyzer (AnalyzeCLDGraph): analyzer of the synced diagram
+            diff (dict): changes returned by LoopyNeo4jLoader.sync
+            checkpoint, on_stage_done: as in load_all
+            max_length (int): maximum length of loops and routes
+
+        Returns:
+            dict: wall time in seconds of each stage and of the whole update
+        """
+        old_edges = diff["old_edges"]
+        old_labels = diff["old_labels"]
+        if diff["removed_nodes"] or any(
+            row["label"] in old_labels.values() for row in diff["relabeled_nodes"]
+        ):
+            return self.load_all(analyzer, checkpoint, on_stage_done)
+
+        checkpoint = checkpoint or (lambda: None)
+        on_stage_done = on_stage_done or (lambda stage: None)
+        self.timings = {}
+        start = time.perf_counter()
+        self.register()
+
+        new_edges = analyzer.extract_edge_list()
+        relabeled = {row["id"] for row in diff["relabeled_nodes"]}
+        relabeled_edges = old_edges.loc[
+            old_edges["source"].isin(relabeled) | old_edges["target"].isin(relabeled),
+            "relationshipID",
+        ].tolist()
+        stale_edges = set(diff["removed_edges"]) | set(relabeled_edges)
+        fresh_edges = set(diff["added_edges"]) | set(relabeled_edges)
+
+        loops = loops_through_edges(new_edges, fresh_edges, max_length=max_length)
+        route_sources = set(nodes_reaching_edges(old_edges, stale_edges))
+        route_sources |= set(nodes_reaching_edges(new_edges, fresh_edges))
+        new_labels = dict(zip(new_edges["source"], new_edges["source_label"]))
+        new_labels.update(zip(new_edges["target"], new_edges["target_label"]))
+        stale_starts = {old_labels[x] for x in route_sources if x in old_labels}
+        stale_starts |= {new_labels[x] for x in route_sources if x in new_labels}
+        self.timings["diff"] = time.perf_counter() - start
+        on_stage_done("loops")
+        checkpoint()
+
+        stage_start = time.perf_counter()
+        with self.engine.begin() as connection:
+            stale_loops = self._select_in(
+                connection,
+                "SELECT DISTINCT loopID FROM bridge_rel_loops_custom",
+                "relationshipID",
+                stale_edges,
+            )
+            # the bridge rows of the deleted loops and routes cascade
+            self._delete_in(connection, "loops_custom", "loopID", stale_loops)
+            self._delete_in(connection, "routes_custom", "start_node", stale_starts)
+            self._delete_in(
+                connection,
+                "relationships_custom",
+                "relationshipID",
+                diff["removed_edges"],
+            )
+
+            for row in diff["relabeled_nodes"] + diff["moved_nodes"]:
+                connection.execute(
+                    text(
+                        "UPDATE nodes_custom SET node_name = :label, pos_x = :x, pos_y = :y "
+                        "WHERE cldID = :cld_id AND node_name = :old_label"
+                    ),
+                    {"old_label": row["label"], **row, "cld_id": self.cld_id},
+                )
+            if diff["added_nodes"]:
+                connection.execute(
+                    text(
+                        "INSERT INTO nodes_custom (cldID, nodeID, node_name, pos_x, pos_y) "
+                        "VALUES (:cld_id, :id, :label, :x, :y)"
+                    ),
+                    [{**row, "cld_id": self.cld_id} for row in diff["added_nodes"]],
+                )
+
+        added = new_edges[new_edges["relationshipID"].isin(diff["added_edges"])]
+        if not added.empty:
+            self.load_relationships(
+                added[["relationshipID", "type"]].copy(), append=True
+            )
+        if not loops.empty:
+            self._load_loop_tables(loops, self._next_id("loops_custom", "loopID"))
+        self.refresh_loop_summaries()
+        self.timings["persist"] = time.perf_counter() - stage_start
+        on_stage_done("persist")
+        checkpoint()
+
+        stage_start = time.perf_counter()
+        self.routes_written = self.load_routes(
+            _checked(
+                iter_routes_from_edges(
+                    new_edges, max_length, start_nodes=sorted(route_sources)
+                ),
+                checkpoint,
+            ),
+            first_id=self._next_id("routes_custom", "routeID"),
+        )
+        self.refresh_route_summary()
+        self.timings["routes"] = time.perf_counter() - stage_start
+        on_stage_done("routes")
+
+        self.timings["total"] = time.perf_counter() - start
+        return self.timings
+
+    def refresh_loop_summaries(self):
+        """
+        Rewrite the loop summary tables of the diagram from loops_custom and
+        bridge_nodes_loops_custom: loop counts by length and state, and the
+        loops of each node split by polarity.
+        """
+        params = {"cld_id": self.cld_id}
+        with self.engine.begin() as connection:
+            connection.execute(
+                text("DELETE FROM loop_length_summary_custom WHERE cldID = :cld_id"),
+                params,
+            )
+            connection.execute(
+                text(
+                    "INSERT INTO loop_length_summary_custom "
+                    "(cldID, loop_length, state, number_of_loops) "
+                    "SELECT cldID, loop_length, state, COUNT(*) FROM loops_custom "
+                    "WHERE cldID = :cld_id GROUP BY cldID, loop_length, state"
+                ),
+                params,
+            )
+            connection.execute(
+                text("DELETE FROM node_loop_summary_custom WHERE cldID = :cld_id"),
+                params,
+            )
+            connection.execute(
+                text(
+                    "INSERT INTO node_loop_summary_custom "
+                    "(cldID, node_name, balancing_loops, reinforcing_loops) "
+                    "SELECT b.cldID, b.node_name, "
+                    "SUM(l.state = 'balancing'), SUM(l.state = 'reinforcing') "
+                    "FROM bridge_nodes_loops_custom AS b "
+                    "JOIN loops_custom AS l ON l.cldID = b.cldID AND l.loopID = b.loopID "
+                    "WHERE b.cldID = :cld_id GROUP BY b.cldID, b.node_name"
+                ),
+                params,
+            )
+        invalidate_loop_statistics("loops_custom", self.cld_id)
+
+    def refresh_route_summary(self):
+        """Rewrite the route counts by (start_node, end_node, state, route_length)."""
+        params = {"cld_id": self.cld_id}
+        with self.engine.begin() as connection:
+            connection.execute(
+                text("DELETE FROM route_summary_custom WHERE cldID = :cld_id"), params
+            )
+            connection.execute(
+                text(
+                    "INSERT INTO route_summary_custom "
+                    "(cldID, start_node, end_node, state, route_length, number_of_routes) "
+                    "SELECT cldID, start_node, end_node, state, route_length, COUNT(*) "
+                    "FROM routes_custom WHERE cldID = :cld_id "
+                    "GROUP BY cldID, start_node, end_node, state, route_length"
+                ),
+                params,
+            )
+
+    def _select_in(self, connection, select, column, values) -> list:
+        values = list(values)
+        found = set()
+        for i in range(0, len(values), 1000):
+            chunk = values[i : i + 1000]
+            placeholders = ", ".join(f":v{j}" for j in range(len(chunk)))
+            rows = connection.execute(
+                text(
+                    f"{select} WHERE cldID = :cld_id AND {column} IN ({placeholders})"
+                ),
+                {"cld_id": self.cld_id, **{f"v{j}": v for j, v in enumerate(chunk)}},
+            )
+            found.update(row[0] for row in rows)
+        return sorted(found)
+
+    def _delete_in(self, connection, table_name, column, values):
+        values = list(values)
+        for i in range(0, len(values), 1000):
+            chunk = values[i : i + 1000]
+            placeholders = ", ".join(f":v{j}" for j in range(len(chunk)))
+            connection.execute(
+                text(
+                    f"DELETE FROM {table_name} "
+                    f"WHERE cldID = :cld_id AND {column} IN ({placeholders})"
+                ),
+                {"cld_id": self.cld_id, **{f"v{j}": v for j, v in enumerate(chunk)}},
+            )
+
+    def load_routes(
+        self, routes, batch_size: int = ROUTES_BATCH_SIZE, first_id: int = 1
+    ) -> int:
+        """
+        Write the routes to routes_custom in fixed-size batches, together
+        with their rows of bridge_nodes_routes_custom and
+        bridge_rel_routes_custom. The relationships of the diagram must
+        already be stored.
+
+        Args:
+            routes: iterable of records with start_node, end_node, route,
+                route_length and state (e.g. AnalyzeCLDGraph.iter_routes()),
+                or the DataFrame returned by extract_routes
+            batch_size (int): rows sent per executemany call
+            first_id (int): id of the first route. With the default the
+                stored routes of the diagram are replaced, otherwise the
+                routes are appended to them.
+
+        Returns:
+            int: number of routes written
+        """
+        if isinstance(routes, pd.DataFrame):
+            routes = routes.to_dict("records")
+
+        inserts = (
+            "INSERT INTO routes_custom "
+            "(cldID, routeID, start_node, end_node, route_code, route_length, state) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            "INSERT INTO bridge_nodes_routes_custom (cldID, node_name, routeID) "
+            "VALUES (%s, %s, %s)",
+            "INSERT INTO bridge_rel_routes_custom "
+            "(cldID, relationshipID, routeID, type_rel, delay) "
+            "VALUES (%s, %s, %s, %s, %s)",
+        )
+        attributes = self._relationship_attributes()
+        node_ids = self._node_ids()
+        written = 0
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            if first_id == 1:
+                # the bridge rows of the routes cascade
+                cursor.execute(
+                    "DELETE FROM routes_custom WHERE cldID = %s", (self.cld_id,)
+                )
+            # routes, node bridge and relationship bridge rows of the batch
+            batch = ([], [], [])
+            for record in routes:
+                route_id = first_id + written
+                route = record["route"]
+                batch[0].append(
+                    (
+                        self.cld_id,
+                        route_id,
+                        record["start_node"],
+                        record["end_node"],
+                        encode_path(route, node_ids),
+                        record["route_length"],
+                        record["state"],
+                    )
+                )
+                batch[1].extend((self.cld_id, node, route_id) for node in route[::2])
+                batch[2].extend(
+                    (self.cld_id, int(rel), route_id, *attributes[int(rel)])
+                    for rel in route[1::2]
+                )
+                written += 1
+                if len(batch[0]) >= batch_size:
+                    self._write_route_batch(cursor, inserts, batch)
+                    connection.commit()
+                    batch = ([], [], [])
+            self._write_route_batch(cursor, inserts, batch)
+            connection.commit()
+            cursor.close()
+        finally:
+            connection.close()
+        return written
+
+    def _write_route_batch(self, cursor, inserts, batch):
+        # routes first: the bridge rows reference them
+        for insert, rows in zip(inserts, batch):
+            if rows:
+                cursor.executemany(insert, rows)
+
+
+def _checked(records, checkpoint):
+    for record in records:
+        checkpoint()
+        yield record
@@ -0,0 +1,404 @@
+import numpy as np
+import pandas as pd
+
+
+class CompactGraph:
+    """
+    Compact adjacency representation of a CLD, built once from its edge list.
+
+    Nodes are ranked by their Loopy ``external_id`` so that rank 0 is the node
+    with the smallest id. Outgoing edges are stored in CSR form: the edges of
+    node ``v`` are ``out_edges[v]``, each one being an index into the edge
+    arrays (``targets``, ``rel_ids``, ``rel_types``). Parallel edges are kept.
+
+    Args:
+        edges (pd.DataFrame): one row per relationship with the columns
+            ``source``, ``target`` (external ids), ``source_label``,
+            ``target_label``, ``relationshipID`` and ``type``.
+    """
+
+    def __init__(self, edges: pd.DataFrame):
+        external_ids = np.unique(
+            np.concatenate(
+                [edges["source"].to_numpy(), edges["target"].to_numpy()]
+            ).astype(np.int64)
+        )
+        self.external_ids = external_ids
+        self.n_nodes = len(external_ids)
+
+        sources = np.searchsorted(external_ids, edges["source"].to_numpy(np.int64))
+        targets = np.searchsorted(external_ids, edges["target"].to_numpy(np.int64))
+
+        labels = np.empty(self.n_nodes, dtype=object)
+        labels[sources] = edges["source_label"].to_numpy()
+        labels[targets] = edges["target_label"].to_numpy()
+        self.labels = labels.tolist()
+
+        order = np.argsort(sources, kind="stable")
+        indptr = np.zeros(self.n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=self.n_nodes), out=indptr[1:])
+        self.indptr = indptr
+        self.sources = sources.tolist()
+        self.targets = targets.tolist()
+        self.rel_ids = edges["relationshipID"].to_numpy(np.int64).tolist()
+        self.rel_types = edges["type"].tolist()
+
+        order = order.tolist()
+        self.out_edges = [
+            order[indptr[v] : indptr[v + 1]] for v in range(self.n_nodes)
+        ]
+        self.successors = [
+            [self.targets[e] for e in self.out_edges[v]] for v in range(self.n_nodes)
+        ]
+        self.predecessors = [[] for _ in range(self.n_nodes)]
+        for u, w in zip(self.sources, self.targets):
+            self.predecessors[w].append(u)
+
+    def _reachable(self, start: int, allowed: np.ndarray, forward: bool = True):
+        """Boolean mask of the allowed nodes reachable from (or reaching) start."""
+        neighbours = self.successors if forward else self.predecessors
+        seen = np.zeros(self.n_nodes, dtype=bool)
+        seen[start] = True
+        stack = [start]
+        while stack:
+            v = stack.pop()
+            for w in neighbours[v]:
+                if allowed[w] and not seen[w]:
+                    seen[w] = True
+                    stack.append(w)
+        return seen
+
+    def simple_cycles(self, min_length: int = 2, max_length: int = 20):
+        """
+        Enumerate the elementary circuits of the graph (Johnson's algorithm).
+
+        The search uses the length-bounded blocking scheme of Gupta and
+        Suzumura, so pruning stays valid with ``max_length``. Each circuit is
+        reported once, rotated to start from its node with the smallest
+        ``external_id``, which matches the Cypher query of
+        ``AnalyzeCLDGraph``.
+
+        Yields:
+            tuple[list[int], list[int]]: node ranks and edge indices of the
+            circuit; edge ``i`` goes from node ``i`` to node ``i + 1``
+            (wrapping around).
+        """
+        allowed = np.ones(self.n_nodes, dtype=bool)
+        for start in range(self.n_nodes):
+            # Only the strongly connected component of start, among the nodes
+            # not yet used as a start, can hold circuits starting from it
+            component = self._reachable(start, allowed) & self._reachable(
+                start, allowed, forward=False
+            )
+            if component.sum() > 1 or any(
+                self.targets[e] == start for e in self.out_edges[start]
+            ):
+                yield from self._bounded_cycle_search(
+                    start, component, min_length, max_length
+                )
+            allowed[start] = False
+
+    def _bounded_cycle_search(self, start, component, min_length, max_length):
+        lock = {start: 0}
+        blocked_by = {}
+        path = [start]
+        edge_path = []
+        stack = [iter(self.out_edges[start])]
+        # Shortest distance back to start found from each frame of the stack
+        blen = [max_length]
+
+        while stack:
+            for e in stack[-1]:
+                w = self.targets[e]
+                if w == start:
+                    if len(path) >= min_length:
+                        yield list(path), edge_path + [e]
+                    blen[-1] = 1
+                elif component[w] and len(path) < lock.get(w, max_length):
+                    stack.append(iter(self.out_edges[w]))
+                    blen.append(max_length)
+                    lock[w] = len(path)
+                    path.append(w)
+                    edge_path.append(e)
+                    break
+            else:
+                stack.pop()
+                v = path.pop()
+                if edge_path:
+                    edge_path.pop()
+                bl = blen.pop()
+                if blen:
+                    blen[-1] = min(blen[-1], bl + 1)
+                if bl < max_length:
+                    relax = [(bl, v)]
+                    while relax:
+                        bl, u = relax.pop()
+                        if lock.get(u, max_length) < max_length - bl + 1:
+                            lock[u] = max_length - bl + 1
+                            relax.extend(
+                                (bl + 1, x)
+                                for x in blocked_by.get(u, ())
+                                if x not in path
+                            )
+                else:
+                    for e in self.out_edges[v]:
+                        blocked_by.setdefault(self.targets[e], set()).add(v)
+
+    def _distance_to(self, is_target: np.ndarray) -> np.ndarray:
+        """Number of edges of the shortest path from each node to any target."""
+        dist = np.full(self.n_nodes, np.iinfo(np.int64).max // 2, dtype=np.int64)
+        frontier = np.flatnonzero(is_target).tolist()
+        dist[frontier] = 0
+        while frontier:
+            next_frontier = []
+            for v in frontier:
+                for u in self.predecessors[v]:
+                    if dist[u] > dist[v] + 1:
+                        dist[u] = dist[v] + 1
+                        next_frontier.append(u)
+            frontier = next_frontier
+        return dist
+
+    def simple_paths(
+        self,
+        max_length: int = 20,
+        sources=None,
+        targets=None,
+        max_paths_per_pair: int = None,
+        skip_edges=None,
+    ):
+        """
+        Enumerate the simple paths between distinct nodes, one DFS per source.
+
+        Every node reached by the search of a source is the end of a path,
+        so all the targets of a source are served by a single traversal.
+        A branch is cut as soon as no target can be reached from it within
+        the remaining length (shortest distance to the targets), and the
+        search of a source stops once every target reachable from it has used
+        up its ``max_paths_per_pair`` budget.
+
+        Args:
+            max_length (int): maximum number of edges of a path
+            sources: node ranks to start from (all nodes if None)
+            targets: node ranks to end at (all nodes if None)
+            max_paths_per_pair (int): optional cap on the paths reported for
+                each (source, target) pair
+            skip_edges: edge indices the paths must not use
+
+        Yields:
+            tuple[list[int], list[int]]: node ranks and edge indices of the
+            path; edge ``i`` goes from node ``i`` to node ``i + 1``.
+        """
+        if targets is None:
+            is_target = np.ones(self.n_nodes, dtype=bool)
+        else:
+            is_target = np.zeros(self.n_nodes, dtype=bool)
+            is_target[list(targets)] = True
+        dist = self._distance_to(is_target).tolist()
+        everything = np.ones(self.n_nodes, dtype=bool)
+
+        for start in range(self.n_nodes) if sources is None else sources:
+            if dist[start] > max_length:
+                continue
+            if max_paths_per_pair is not None:
+                counts = {}
+                reachable = self._reachable(start, everything) & is_target
+                remaining = int(reachable.sum()) - int(reachable[start])
+            on_path = [False] * self.n_nodes
+            on_path[start] = True
+            path = [start]
+            edge_path = []
+            stack = [iter(self.out_edges[start])]
+
+            while stack:
+                for e in stack[-1]:
+                    w = self.targets[e]
+                    depth = len(edge_path) + 1
+                    if on_path[w] or depth + dist[w] > max_length:
+                        continue
+                    if skip_edges is not None and e in skip_edges:
+                        continue
+                    if is_target[w]:
+                        if max_paths_per_pair is None:
+                            yield path + [w], edge_path + [e]
+                        elif counts.get(w, 0) < max_paths_per_pair:
+                            counts[w] = counts.get(w, 0) + 1
+                            yield path + [w], edge_path + [e]
+                            if counts[w] == max_paths_per_pair:
+                                remaining -= 1
+                    if depth < max_length:
+                        on_path[w] = True
+                        path.append(w)
+                        edge_path.append(e)
+                        stack.append(iter(self.out_edges[w]))
+                        break
+                else:
+                    stack.pop()
+                    if edge_path:
+                        on_path[path.pop()] = False
+                        edge_path.pop()
+                if max_paths_per_pair is not None and remaining <= 0:
+                    break
+
+    def cycles_through(self, edge_indices, min_length: int = 2, max_length: int = 20):
+        """
+        Enumerate the elementary circuits that use at least one of the given edges.
+
+        A circuit through edge ``u -> v`` is that edge closed by a simple path
+        from ``v`` back to ``u``. The edges are processed in order and the
+        search for each of them skips the edges already processed, so a
+        circuit through several of them is reported once. Circuits are
+        rotated like in ``simple_cycles``.
+
+        Yields:
+            tuple[list[int], list[int]]: node ranks and edge indices of the
+            circuit, as in ``simple_cycles``.
+        """
+        done = set()
+        for e in edge_indices:
+            u, v = self.sources[e], self.targets[e]
+            if u != v:
+                for nodes, edges in self.simple_paths(
+                    max_length - 1, sources=[v], targets=[u], skip_edges=done
+                ):
+                    if len(edges) + 1 < min_length:
+                        continue
+                    nodes = [u] + nodes[:-1]
+                    edges = [e] + edges
+                    first = nodes.index(min(nodes))
+                    yield nodes[first:] + nodes[:first], edges[first:] + edges[:first]
+            done.add(e)
+
+    def edge_indices(self, relationship_ids) -> list:
+        """Edge indices of the given relationship ids (unknown ids are ignored)."""
+        wanted = set(relationship_ids)
+        return [e for e, rid in enumerate(self.rel_ids) if rid in wanted]
+
+    def ranks(self, external_ids) -> list:
+        """Node ranks of the given external ids (unknown ids are ignored)."""
+        known = set(self.external_ids.tolist())
+        return [
+            int(np.searchsorted(self.external_ids, x))
+            for x in external_ids
+            if x in known
+        ]
+
+    def nodes_reaching(self, edge_indices) -> list:
+        """External ids of the nodes with a path to the source of any given edge."""
+        is_target = np.zeros(self.n_nodes, dtype=bool)
+        is_target[[self.sources[e] for e in edge_indices]] = True
+        reaching = self._distance_to(is_target) <= self.n_nodes
+        return self.external_ids[reaching].tolist()
+
+
+def _loop_row(graph: CompactGraph, nodes, edge_ids):
+    loop_path = []
+    for v, e in zip(nodes, edge_ids):
+        loop_path.append(graph.labels[v])
+        loop_path.append(str(graph.rel_ids[e]))
+    disc = sum(1 for e in edge_ids if graph.rel_types[e] == "DISC_CHANGE")
+    state = "reinforcing" if disc % 2 == 0 else "balancing"
+    return loop_path, state, len(edge_ids)
+
+
+def loops_from_edges(
+    edges: pd.DataFrame, min_length: int = 2, max_length: int = 20
+) -> pd.DataFrame:
+    """
+    Enumerate the loops of a CLD from its edge list.
+
+    Returns a DataFrame with the same shape as the Neo4j loop query:
+    ``loop_path`` (alternating node labels and relationship ids as strings),
+    ``state`` (``reinforcing`` when the number of ``DISC_CHANGE`` links is
+    even, ``balancing`` otherwise) and ``loop_length``.
+    """
+    columns = ["loop_path", "state", "loop_length"]
+    if edges.empty:
+        return pd.DataFrame(columns=columns)
+
+    graph = CompactGraph(edges)
+    rows = [
+        _loop_row(graph, nodes, edge_ids)
+        for nodes, edge_ids in graph.simple_cycles(min_length, max_length)
+    ]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def loops_through_edges(
+    edges: pd.DataFrame, relationship_ids, min_length: int = 2, max_length: int = 20
+) -> pd.DataFrame:
+    """
+    The loops of ``loops_from_edges`` that use at least one of the given
+    relationships, e.g. the ones added by an edit of the diagram.
+    """
+    columns = ["loop_path", "state", "loop_length"]
+    if edges.empty:
+        return pd.DataFrame(columns=columns)
+
+    graph = CompactGraph(edges)
+    rows = [
+        _loop_row(graph, nodes, edge_ids)
+        for nodes, edge_ids in graph.cycles_through(
+            graph.edge_indices(relationship_ids), min_length, max_length
+        )
+    ]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def nodes_reaching_edges(edges: pd.DataFrame, relationship_ids) -> list:
+    """External ids of the nodes that can reach any of the given relationships."""
+    if edges.empty:
+        return []
+    graph = CompactGraph(edges)
+    return graph.nodes_reaching(graph.edge_indices(relationship_ids))
+
+
+def iter_routes_from_edges(
+    edges: pd.DataFrame,
+    max_length: int = 20,
+    max_routes_per_pair: int = None,
+    start_nodes=None,
+):
+    """
+    Enumerate the routes of a CLD from its edge list, one record at a time.
+
+    Each record has the same fields as the Neo4j route query: ``start_node``,
+    ``end_node``, ``route`` (alternating node labels and relationship ids as
+    strings), ``route_length`` and ``state`` (``increasing`` when the number
+    of ``DISC_CHANGE`` links is even, ``decreasing`` otherwise).
+
+    ``start_nodes`` optionally restricts the routes to the ones starting from
+    the given external ids.
+    """
+    if edges.empty:
+        return
+
+    graph = CompactGraph(edges)
+    sources = None if start_nodes is None else graph.ranks(start_nodes)
+    for nodes, edge_ids in graph.simple_paths(
+        max_length, sources=sources, max_paths_per_pair=max_routes_per_pair
+    ):
+        route = []
+        for v, e in zip(nodes, edge_ids):
+            route.append(graph.labels[v])
+            route.append(str(graph.rel_ids[e]))
+        route.append(graph.labels[nodes[-1]])
+        disc = sum(1 for e in edge_ids if graph.rel_types[e] == "DISC_CHANGE")
+        yield {
+            "start_node": graph.labels[nodes[0]],
+            "end_node": graph.labels[nodes[-1]],
+            "route": route,
+            "route_length": len(edge_ids),
+            "state": "increasing" if disc % 2 == 0 else "decreasing",
+        }
+
+
+def routes_from_edges(
+    edges: pd.DataFrame, max_length: int = 20, max_routes_per_pair: int = None
+) -> pd.DataFrame:
+    """DataFrame of all the routes of a CLD (see ``iter_routes_from_edges``)."""
+    columns = ["start_node", "end_node", "route", "route_length", "state"]
+    return pd.DataFrame(
+        list(iter_routes_from_edges(edges, max_length, max_routes_per_pair)),
+        columns=columns,
+    )
@@ -1,16 +1,42 @@
+import hashlib
 import json
+import time
 from urllib.parse import parse_qs, unquote, urlparse
 from uuid import uuid4
 
+import numpy as np
+import pandas as pd
 from graphviz import Digraph
-from neo4j import GraphDatabase
+
+from models.neo4j_driver import get_driver, pooled_session
 
 
 class Loopy:
     def __init__(self, data: str):
         self.data = data
 
+    @property
+    def version(self) -> str:
+        """Hash of the Loopy link, identifying this version of the diagram."""
+        return hashlib.sha256(self.data.encode()).hexdigest()[:16]
+
+    # Loopy arrays: [id, x, y, init_value, label, hue] and
+    # [source, target, arc, strength, rotation]
+    NODE_COLUMNS = ["id", "x", "y", "init_value", "label", "hue"]
+    EDGE_COLUMNS = ["source", "target", "arc", "strength", "rotation"]
+
     def load(self):
+        """
+        Parse the Loopy link into the columnar tables node_table and edge_table.
+
+        Labels are URL-decoded, empty or "?" labels get the anonymous names
+        "_1", "_2", ... and digit-only labels get a trailing "_". Edges whose
+        endpoints are not nodes of the diagram and repeated node ids are
+        rejected.
+
+        Raises:
+            ValueError: if the link does not contain a valid Loopy diagram
+        """
         parsed_url = urlparse(self.data)
         try:
             self.query_list_graph = parse_qs(parsed_url.query)["data"][0]
@@ -19,45 +45,113 @@ class Loopy:
             # 1 are edges
             # 2 are labels - only text objects
             # 3 are uid - only numbers
+            raw_nodes = self.query_list_graph[0]
+            raw_edges = self.query_list_graph[1]
+        except (KeyError, IndexError, TypeError):
+            raise ValueError("Invalid LOOPY URL")
 
-            # Counter for anonymous nodes
-            anonymous_node_counter = 1
-
-            # Process nodes and handle anonymous ones
-            self.nodes = []
-            for x in self.query_list_graph[0]:
-                label = x[4]  # The label is at index 4
-
-                # Handle double URL encoding - decode the label if it contains URL encoded characters
-                try:
-                    # Apply additional URL decoding to handle double-encoded strings
-                    decoded_label = unquote(label)
-                    # If the decoded version is different, use it
-                    if decoded_label != label:
-                        label = decoded_label
-                except Exception:
-                    # If decoding fails, keep the original label
-                    pass
-
-                # If label is empty string, assign anonymous name
-                if label == "" or label == "?":
-                    label = f"_{anonymous_node_counter}"
-                    anonymous_node_counter += 1
-
-                # If label consists only of digits, append underscore
-                if label.isdigit():
-                    label = label + "_"
-
-                node = LoopyNode(x[0], x[1], x[2], x[3], label, x[5])
-                self.nodes.append(node)
-
-            self.edges = [
-                LoopyEdge(x[0], x[1], x[2], x[3], x[4])
-                for x in self.query_list_graph[1]
-            ]
+        self.node_table = self._parse_nodes(raw_nodes)
+        self.edge_table = self._parse_edges(raw_edges)
+        self._validate()
+        self._nodes = None
+        self._edges = None
+
+    @staticmethod
+    def _frame(rows, columns, kind) -> pd.DataFrame:
+        """Build a DataFrame from the Loopy arrays, keeping the known fields."""
+        if not isinstance(rows, list) or not all(isinstance(x, list) for x in rows):
+            raise ValueError(f"Invalid LOOPY URL: malformed {kind}")
+        frame = pd.DataFrame(rows, columns=None if rows else range(len(columns)))
+        if frame.shape[1] < len(columns):
+            raise ValueError(f"Invalid LOOPY URL: {kind} with missing fields")
+        frame = frame.iloc[:, : len(columns)]
+        frame.columns = columns
+        return frame
+
+    @staticmethod
+    def _numeric(frame: pd.DataFrame, columns, kind, integer=()):
+        for column in columns:
+            values = pd.to_numeric(frame[column], errors="coerce")
+            invalid = values.isna()
+            if column in integer:
+                invalid |= values != values.round()
+            if invalid.any():
+                raise ValueError(
+                    f"Invalid LOOPY URL: {kind} with a non-numeric {column} "
+                    f"(rows {invalid.to_numpy().nonzero()[0][:10].tolist()})"
+                )
+            frame[column] = values.astype("int64") if column in integer else values
+
+    def _parse_nodes(self, raw_nodes) -> pd.DataFrame:
+        nodes = self._frame(raw_nodes, self.NODE_COLUMNS, "nodes")
+        self._numeric(
+            nodes, ["id", "x", "y", "init_value", "hue"], "nodes", integer=("id",)
+        )
 
-        except KeyError:
-            raise ValueError("Invalid LOOPY URL")
+        labels = nodes["label"].fillna("").astype(str)
+        # Handle double URL encoding: only labels with a "%" can change
+        encoded = labels.str.contains("%", regex=False)
+        if encoded.any():
+            labels[encoded] = labels[encoded].map(unquote)
+
+        # Anonymous nodes are numbered in diagram order
+        anonymous = labels.isin(["", "?"])
+        if anonymous.any():
+            labels[anonymous] = [f"_{i}" for i in range(1, int(anonymous.sum()) + 1)]
+
+        # If label consists only of digits, append underscore
+        digits = labels.str.isdigit()
+        labels[digits] = labels[digits] + "_"
+
+        nodes["label"] = labels
+        return nodes
+
+    def _parse_edges(self, raw_edges) -> pd.DataFrame:
+        edges = self._frame(raw_edges, self.EDGE_COLUMNS, "edges")
+        self._numeric(
+            edges,
+            self.EDGE_COLUMNS,
+            "edges",
+            integer=("source", "target"),
+        )
+        return edges
+
+    def _validate(self):
+        """Check node ids and edge endpoints of the whole diagram at once."""
+        ids = self.node_table["id"]
+        duplicated = ids[ids.duplicated()].unique()
+        if len(duplicated):
+            raise ValueError(
+                f"Invalid LOOPY URL: duplicate node ids {duplicated[:10].tolist()}"
+            )
+
+        dangling = ~self.edge_table["source"].isin(ids) | ~self.edge_table[
+            "target"
+        ].isin(ids)
+        if dangling.any():
+            pairs = self.edge_table.loc[dangling, ["source", "target"]]
+            raise ValueError(
+                "Invalid LOOPY URL: edges between unknown nodes "
+                f"{list(pairs.itertuples(index=False, name=None))[:10]}"
+            )
+
+    @property
+    def nodes(self) -> list:
+        """LoopyNode objects of the diagram, built on first access."""
+        if self._nodes is None:
+            self._nodes = [
+                LoopyNode(**row) for row in self.node_table.to_dict("records")
+            ]
+        return self._nodes
+
+    @property
+    def edges(self) -> list:
+        """LoopyEdge objects of the diagram, built on first access."""
+        if self._edges is None:
+            self._edges = [
+                LoopyEdge(**row) for row in self.edge_table.to_dict("records")
+            ]
+        return self._edges
 
     def to_svg(self, width=600, height=400, output_path=None):
         """
@@ -89,56 +183,40 @@ class Loopy:
         dot.attr(splines="true", overlap="false")
 
         # Add nodes with their positions
-        for node in self.nodes:
-            # Loopy coordinates range from 0-200 or similar, need to convert to graphviz coordinates
-            # First, normalize coordinates to 0-1 range, then scale to desired size in inches
-            # Assuming Loopy coords are roughly in 0-200 range
-            max_coord = 200
-            pos_x = (node.x / max_coord) * (width / 72)  # Convert to inches
-            pos_y = ((max_coord - node.y) / max_coord) * (
-                height / 72
-            )  # Flip Y and convert to inches
-
-            # Use hue to determine node color (convert from HSV hue to a color)
-            # hue_normalized = (node.hue % 360) / 360  # Normalize to 0-1 range
-            # hue_color = (
-            #     f"{hue_normalized:.3f} 0.7 0.9"  # HSV format: hue saturation value
-            # )
-
+        # Loopy coordinates range from 0-200 or similar, need to convert to graphviz coordinates
+        # First, normalize coordinates to 0-1 range, then scale to desired size in inches
+        # Assuming Loopy coords are roughly in 0-200 range
+        max_coord = 200
+        nodes = self.node_table
+        pos_x = (nodes["x"] / max_coord) * (width / 72)  # Convert to inches
+        pos_y = ((max_coord - nodes["y"]) / max_coord) * (
+            height / 72
+        )  # Flip Y and convert to inches
+        for node_id, label, x, y in zip(
+            nodes["id"].astype(str), nodes["label"], pos_x, pos_y
+        ):
             dot.node(
-                str(node.id),
-                label=node.label,
-                pos=f"{pos_x},{pos_y}!",
+                node_id,
+                label=label,
+                pos=f"{x},{y}!",
                 style="filled",
                 fillcolor="white",
                 color="black",
             )
 
-        # Add edges based on their strength (positive = CONC_CHANGE, negative = DISC_CHANGE)
-        for edge in self.edges:
-            source_id = str(edge.source)
-            target_id = str(edge.target)
-
-            # Determine edge style based on strength (similar to routes_generator logic)
-            if edge.strength > 0:
-                # Positive feedback (reinforcing) - solid line
-                edge_style = "solid"
-                edge_color = "black"
-            else:
-                # Negative feedback (balancing) - dashed line
-                edge_style = "dashed"
-                edge_color = "black"
-
-            # Add strength as edge label
-            # edge_label = f"{abs(edge.strength)}"
-
+        # Add edges based on their strength: positive feedback (reinforcing) is a
+        # solid line, negative feedback (balancing) a dashed line
+        edges = self.edge_table
+        styles = np.where(edges["strength"] > 0, "solid", "dashed")
+        for source_id, target_id, edge_style in zip(
+            edges["source"].astype(str), edges["target"].astype(str), styles
+        ):
             dot.edge(
                 source_id,
                 target_id,
-                style=edge_style,
-                color=edge_color,
-                # label=edge_label,
-                fontcolor=edge_color,
+                style=str(edge_style),
+                color="black",
+                fontcolor="black",
             )
 
         if output_path:
@@ -188,20 +266,89 @@ class LoopyNeo4jLoader:
         self.url = url
         self.user = user
         self.password = password
+        self.driver = get_driver(self.url, self.user, self.password)
 
-        with GraphDatabase.driver(self.url, auth=(self.user, self.password)) as driver:
-            try:
-                self.session = driver.verify_connectivity()
-            except Exception as e:
-                raise ValueError(f"Could not connect to database: {e}")
+    def load(self, loopy: Loopy, bulk: bool = True):
+        """
+        Import a Loopy diagram in Neo4j, replacing the one stored for this uuid.
 
-    def load(self, loopy: Loopy):
-        self.clear()
-        for node in loopy.nodes:
-            self.load_node(node)
+        Args:
+            loopy (Loopy): parsed diagram
+            bulk (bool): send all nodes and then all edges with UNWIND over a
+                single driver, instead of one driver and transaction per element
 
-        for edge in loopy.edges:
-            self.load_edge(edge)
+        Returns:
+            dict: wall time in seconds of each phase (clear, nodes, edges)
+        """
+        self.timings = {}
+        start = time.perf_counter()
+        self.clear()
+        self.timings["clear"] = time.perf_counter() - start
+
+        if bulk:
+            with pooled_session(self.driver) as session:
+                session.run(
+                    "CREATE INDEX node_uuid_external_id IF NOT EXISTS "
+                    "FOR (n:Node) ON (n.uuid, n.external_id)"
+                ).consume()
+
+                start = time.perf_counter()
+                session.execute_write(
+                    self._tx_merge_nodes, self._node_rows(loopy.node_table)
+                )
+                self.timings["nodes"] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                session.execute_write(
+                    self._tx_merge_edges, loopy.edge_table.to_dict("records")
+                )
+                self.timings["edges"] = time.perf_counter() - start
+        else:
+            start = time.perf_counter()
+            for node in loopy.nodes:
+                self.load_node(node)
+            self.timings["nodes"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for edge in loopy.edges:
+                self.load_edge(edge)
+            self.timings["edges"] = time.perf_counter() - start
+
+        return self.timings
+
+    @staticmethod
+    def _node_rows(nodes: pd.DataFrame) -> list:
+        # to_dict converts the numpy scalars to the Python types the driver accepts
+        return nodes[Loopy.NODE_COLUMNS].to_dict("records")
+
+    @staticmethod
+    def _edge_rows(edges) -> dict:
+        # The relationship type cannot be a query parameter: one UNWIND per type
+        rows_by_label = {"CONG_CHANGE": [], "DISC_CHANGE": []}
+        for edge in edges:
+            edge_label = "CONG_CHANGE" if edge["strength"] > 0 else "DISC_CHANGE"
+            rows_by_label[edge_label].append(edge)
+        return rows_by_label
+
+    def _tx_merge_nodes(self, tx, rows):
+        tx.run(
+            "UNWIND $rows AS row "
+            "MERGE (n:Node {external_id: row.id, x: row.x, y: row.y, init_value: row.init_value, label: row.label, hue: row.hue, uuid: $uuid})",
+            rows=rows,
+            uuid=self.uuid,
+        ).consume()
+
+    def _tx_merge_edges(self, tx, edges):
+        for edge_label, rows in self._edge_rows(edges).items():
+            if not rows:
+                continue
+            tx.run(
+                "UNWIND $rows AS row "
+                "MATCH (source:Node {external_id: row.source, uuid: $uuid}), (target:Node {external_id: row.target, uuid: $uuid}) "
+                f"MERGE (source)-[:{edge_label} {{arc: row.arc, strength: row.strength, rotation: row.rotation, uuid: $uuid}}]->(target)",
+                rows=rows,
+                uuid=self.uuid,
+            ).consume()
 
     def load_node(self, node: LoopyNode):
         def _tx_merge_node(tx, node):
@@ -216,9 +363,8 @@ class LoopyNeo4jLoader:
                 uuid=self.uuid,
             )
 
-        with GraphDatabase.driver(self.url, auth=(self.user, self.password)) as driver:
-            with driver.session(database="neo4j") as session:
-                session.execute_write(_tx_merge_node, node)
+        with pooled_session(self.driver) as session:
+            session.execute_write(_tx_merge_node, node)
 
     def load_edge(self, edge: LoopyEdge):
         """
@@ -238,12 +384,203 @@ class LoopyNeo4jLoader:
                 uuid=self.uuid,
             )
 
-        with GraphDatabase.driver(self.url, auth=(self.user, self.password)) as driver:
-            with driver.session(database="neo4j") as session:
-                session.execute_write(_tx_merge_edge, edge)
+        with pooled_session(self.driver) as session:
+            session.execute_write(_tx_merge_edge, edge)
 
     def clear(self):
-        with GraphDatabase.driver(self.url, auth=(self.user, self.password)) as driver:
-            with driver.session(database="neo4j") as session:
-                session.run("MATCH (n {uuid: $uuid}) DETACH DELETE n", uuid=self.uuid)
-                session.run("MATCH (n {uuid: $uuid}) DETACH DELETE n", uuid=self.uuid)
+        with pooled_session(self.driver) as session:
+            session.run(
+                "MATCH (n {uuid: $uuid}) DETACH DELETE n", uuid=self.uuid
+            ).consume()
+
+    def sync(self, loopy: Loopy) -> dict:
+        """
+        Update the stored diagram to match loopy, applying only the differences.
+
+        Nodes are matched by their Loopy id. Edges are matched by source,
+        target and polarity, so an edge whose polarity is flipped is deleted
+        and created again. Unchanged elements keep their Neo4j ids.
+
+        Returns:
+            dict: the changes applied, with the keys
+                old_edges: edge list stored before the sync, in the format of
+                    AnalyzeCLDGraph.extract_edge_list
+                old_labels: label of every stored node before the sync, by Loopy id
+                removed_edges / added_edges: relationship ids deleted / created
+                removed_nodes: Loopy ids deleted
+                added_nodes: rows (id, label, x, y, ...) of the nodes created
+                relabeled_nodes: rows of the nodes whose label changed, with
+                    their previous label as old_label
+                moved_nodes: rows of the nodes whose other attributes changed
+        """
+        self.timings = {}
+        start = time.perf_counter()
+        with pooled_session(self.driver) as session:
+            stored_nodes, stored_edges = session.execute_read(self._tx_read_graph)
+        self.timings["read"] = time.perf_counter() - start
+
+        new_nodes = {node["id"]: node for node in self._node_rows(loopy.node_table)}
+        removed_nodes = [x for x in stored_nodes if x not in new_nodes]
+        added_nodes = [node for x, node in new_nodes.items() if x not in stored_nodes]
+        relabeled_nodes = []
+        moved_nodes = []
+        for x, node in new_nodes.items():
+            stored = stored_nodes.get(x)
+            if stored is None:
+                continue
+            if stored["label"] != node["label"]:
+                relabeled_nodes.append(x)
+            elif (stored["x"], stored["y"], stored["init_value"], stored["hue"]) != (
+                node["x"],
+                node["y"],
+                node["init_value"],
+                node["hue"],
+            ):
+                moved_nodes.append(x)
+
+        # edges: multiset match on (source, target, type), parallel edges included
+        unmatched = {}
+        for edge in stored_edges:
+            key = (edge["source"], edge["target"], edge["type"])
+            unmatched.setdefault(key, []).append(edge)
+        added_edges = []
+        updated_edges = []
+        for edge in loopy.edge_table.to_dict("records"):
+            edge_label = "CONG_CHANGE" if edge["strength"] > 0 else "DISC_CHANGE"
+            candidates = unmatched.get((edge["source"], edge["target"], edge_label))
+            if candidates:
+                stored = candidates.pop()
+                if (stored["arc"], stored["strength"], stored["rotation"]) != (
+                    edge["arc"],
+                    edge["strength"],
+                    edge["rotation"],
+                ):
+                    updated_edges.append((stored["relationshipID"], edge))
+            else:
+                added_edges.append(edge)
+        removed_edges = [
+            edge["relationshipID"] for edges in unmatched.values() for edge in edges
+        ]
+
+        start = time.perf_counter()
+        with pooled_session(self.driver) as session:
+            added_ids = session.execute_write(
+                self._tx_apply_diff,
+                removed_edges,
+                removed_nodes,
+                added_nodes,
+                [new_nodes[x] for x in relabeled_nodes + moved_nodes],
+                updated_edges,
+                added_edges,
+            )
+        self.timings["write"] = time.perf_counter() - start
+
+        edge_list_columns = [
+            "source",
+            "target",
+            "source_label",
+            "target_label",
+            "relationshipID",
+            "type",
+        ]
+        return {
+            "old_edges": pd.DataFrame(
+                [{c: edge[c] for c in edge_list_columns} for edge in stored_edges],
+                columns=edge_list_columns,
+            ),
+            "old_labels": {x: node["label"] for x, node in stored_nodes.items()},
+            "removed_edges": removed_edges,
+            "added_edges": added_ids,
+            "removed_nodes": removed_nodes,
+            "added_nodes": added_nodes,
+            "relabeled_nodes": [
+                {**new_nodes[x], "old_label": stored_nodes[x]["label"]}
+                for x in relabeled_nodes
+            ],
+            "moved_nodes": [new_nodes[x] for x in moved_nodes],
+        }
+
+    def _tx_read_graph(self, tx):
+        nodes = {
+            record["external_id"]: record.data()
+            for record in tx.run(
+                "MATCH (n:Node {uuid: $uuid}) "
+                "RETURN n.external_id AS external_id, n.label AS label, n.x AS x, "
+                "n.y AS y, n.init_value AS init_value, n.hue AS hue",
+                uuid=self.uuid,
+            )
+        }
+        edges = [
+            record.data()
+            for record in tx.run(
+                "MATCH (a:Node {uuid: $uuid})-[r]->(b:Node {uuid: $uuid}) "
+                "RETURN a.external_id AS source, b.external_id AS target, "
+                "a.label AS source_label, b.label AS target_label, "
+                "id(r) AS relationshipID, type(r) AS type, "
+                "r.arc AS arc, r.strength AS strength, r.rotation AS rotation",
+                uuid=self.uuid,
+            )
+        ]
+        return nodes, edges
+
+    def _tx_apply_diff(
+        self,
+        tx,
+        removed_edges,
+        removed_nodes,
+        added_nodes,
+        changed_nodes,
+        updated_edges,
+        added_edges,
+    ):
+        if removed_edges:
+            tx.run(
+                "MATCH ()-[r]->() WHERE id(r) IN $ids DELETE r", ids=removed_edges
+            ).consume()
+        if removed_nodes:
+            tx.run(
+                "MATCH (n:Node {uuid: $uuid}) WHERE n.external_id IN $ids DETACH DELETE n",
+                ids=removed_nodes,
+                uuid=self.uuid,
+            ).consume()
+        if changed_nodes:
+            tx.run(
+                "UNWIND $rows AS row "
+                "MATCH (n:Node {external_id: row.id, uuid: $uuid}) "
+                "SET n.label = row.label, n.x = row.x, n.y = row.y, "
+                "n.init_value = row.init_value, n.hue = row.hue",
+                rows=changed_nodes,
+                uuid=self.uuid,
+            ).consume()
+        if added_nodes:
+            self._tx_merge_nodes(tx, added_nodes)
+        if updated_edges:
+            tx.run(
+                "UNWIND $rows AS row "
+                "MATCH ()-[r]->() WHERE id(r) = row.id "
+                "SET r.arc = row.arc, r.strength = row.strength, r.rotation = row.rotation",
+                rows=[
+                    {
+                        "id": rel_id,
+                        "arc": edge["arc"],
+                        "strength": edge["strength"],
+                        "rotation": edge["rotation"],
+                    }
+                    for rel_id, edge in updated_edges
+                ],
+            ).consume()
+
+        added_ids = []
+        for edge_label, rows in self._edge_rows(added_edges).items():
+            if not rows:
+                continue
+            result = tx.run(
+                "UNWIND $rows AS row "
+                "MATCH (source:Node {external_id: row.source, uuid: $uuid}), (target:Node {external_id: row.target, uuid: $uuid}) "
+                f"CREATE (source)-[r:{edge_label} {{arc: row.arc, strength: row.strength, rotation: row.rotation, uuid: $uuid}}]->(target) "
+                "RETURN id(r) AS id",
+                rows=rows,
+                uuid=self.uuid,
+            )
+            added_ids.extend(record["id"] for record in result)
+        return added_ids
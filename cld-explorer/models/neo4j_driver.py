@@ -0,0 +1,119 @@
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+
+from neo4j import GraphDatabase
+
+# Pool settings shared by every driver of the process, overridable by env vars
+pool_config = {
+    "max_connection_pool_size": int(os.getenv("NEO4J_MAX_POOL_SIZE", "50")),
+    "connection_acquisition_timeout": float(
+        os.getenv("NEO4J_ACQUISITION_TIMEOUT", "60")
+    ),
+}
+
+# One driver per (url, user) for the whole process. Streamlit reruns the page
+# scripts but keeps imported modules, so the drivers and their pooled
+# connections survive reruns and are shared by all sessions.
+_drivers = {}
+# Hash of the password each driver was created with, by (url, user)
+_auth = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def get_driver(url: str, user: str, password: str):
+    """
+    Return the pooled driver for the given database, creating it on first use.
+
+    A driver created with a different password is closed and replaced.
+    Connectivity is verified only when the driver is created.
+
+    Raises:
+        ValueError: if the database cannot be reached
+    """
+    key = (url, user)
+    auth_hash = hashlib.sha256(password.encode()).hexdigest()
+    with _lock:
+        driver = _drivers.get(key)
+        if driver is not None and _auth[key] == auth_hash:
+            return driver
+
+    # Verified outside the lock: a slow or unreachable server must not block
+    # the sessions of the other drivers
+    driver = GraphDatabase.driver(url, auth=(user, password), **pool_config)
+    try:
+        driver.verify_connectivity()
+    except Exception as e:
+        driver.close()
+        raise ValueError(f"Could not connect to database: {e}")
+
+    with _lock:
+        current = _drivers.get(key)
+        if current is not None and _auth[key] == auth_hash:
+            # another thread registered the same driver in the meantime
+            stale, driver = driver, current
+        else:
+            stale = current
+            if stale is not None:
+                _stats.pop(id(stale), None)
+            _drivers[key] = driver
+            _auth[key] = auth_hash
+    if stale is not None:
+        stale.close()
+    return driver
+
+
+@contextmanager
+def pooled_session(driver, database: str = "neo4j"):
+    """Open a session on a pooled driver, keeping track of pool usage."""
+    with _lock:
+        stats = _stats.setdefault(
+            id(driver),
+            {
+                "sessions_opened": 0,
+                "active_sessions": 0,
+                "peak_active_sessions": 0,
+                "failed_sessions": 0,
+            },
+        )
+        stats["sessions_opened"] += 1
+        stats["active_sessions"] += 1
+        stats["peak_active_sessions"] = max(
+            stats["peak_active_sessions"], stats["active_sessions"]
+        )
+    try:
+        with driver.session(database=database) as session:
+            yield session
+    except Exception:
+        with _lock:
+            stats["failed_sessions"] += 1
+        raise
+    finally:
+        with _lock:
+            stats["active_sessions"] -= 1
+
+
+def session_stats() -> dict:
+    """
+    Pool settings and session counters of every registered driver.
+
+    The counters only cover the sessions opened through pooled_session; they
+    are not the connection pool metrics of the driver itself.
+    """
+    with _lock:
+        return {
+            f"{user}@{url}": {**pool_config, **_stats.get(id(driver), {})}
+            for (url, user), driver in _drivers.items()
+        }
+
+
+def close_drivers():
+    """Close every pooled driver (e.g. on shutdown or in scripts)."""
+    with _lock:
+        for driver in _drivers.values():
+            driver.close()
+        _drivers.clear()
+        _auth.clear()
+        _stats.clear()
@@ -2,9 +2,10 @@ from uuid import uuid4
 
 import streamlit as st
 import streamlit.components.v1 as components
-from db_config import db_config
-from models.causal_loop_diagram import AnalyzeCLDGraph, LoadAnalyses
-from models.loopy import Loopy, LoopyNeo4jLoader
+from db_config import check_health, db_config, get_pool_metrics, neo4j_config
+from models.analysis_jobs import STAGES, get_job, submit_job
+from models.causal_loop_diagram import AnalyzeCLDGraph
+from models.neo4j_driver import session_stats
 
 st.set_page_config(layout="wide")
 st.title("Design your Causal Loop Diagram")
@@ -36,28 +37,32 @@ with st.form("loopy_form"):
     submitted = st.form_submit_button("Load")
 
 if submitted and loopy_import_string:
-    l = Loopy(loopy_import_string)
-    l.load()
-    lnl = LoopyNeo4jLoader(st.session_state.session_id)
-    lnl.set_database_conf("bolt://neo4j:7687", "neo4j", "password")
-    lnl.load(l)
-
-    analyzer = AnalyzeCLDGraph(st.session_state.session_id)
-    analyzer.set_database_conf("bolt://neo4j:7687", "neo4j", "password")
-
-    loader = LoadAnalyses(st.session_state.session_id)
-    loader.set_database_conf(
-        db_config["host"] + ":" + db_config["port"],
-        db_config["user"],
-        db_config["password"],
+    # the analysis runs on the background job pool, the page only polls it
+    job = submit_job(
+        st.session_state.session_id, loopy_import_string, neo4j_config, db_config
     )
-    loader.load_nodes(analyzer.extract_nodes())
-    loader.load_relationships(analyzer.extract_edges())
-    loops = analyzer.extract_loops()
-    nodes_loops = loops.copy(deep=True)
-    loader.load_loops(loops)
-    loader.load_nodes_loops(nodes_loops)
-    loader.load_routes(analyzer.extract_routes())
+    st.session_state.load_job_id = job.id
+
+
+@st.fragment(run_every=1)
+def show_job_progress(job):
+    """Poll the running job; rerun the whole page once it has finished."""
+    if job.finished:
+        st.rerun()
+
+    if job.status == "queued":
+        st.info("Waiting for a free worker...")
+    else:
+        st.progress(
+            job.progress,
+            text=f"Analyzing the diagram: {job.stage} ({len(job.completed)}/{len(STAGES)} stages done)",
+        )
+    if st.button("Cancel"):
+        job.cancel()
+
+
+def show_job_result(job):
+    l = job.result["loopy"]
 
     # Display success message
     st.success("Diagram loaded successfully!")
@@ -69,25 +74,67 @@ if submitted and loopy_import_string:
         f'<div style="text-align: center;">{svg_content}</div>', unsafe_allow_html=True
     )
 
-    # Save svg to file "output/custom_diagram.svg"
-    output_path = "output/custom_diagram.svg"
-    with open(output_path, "w") as f:
-        f.write(svg_content)
+    # Save svg to a per-session file, e.g. "output/custom_diagram_<cldID>.svg"
+    output_path = f"output/custom_diagram_{job.result['cld_id']}.svg"
+    if st.session_state.get("applied_load_job_id") != job.id:
+        with open(output_path, "w") as f:
+            f.write(svg_content)
+
+        # switch the explore pages to the new diagram only once per job
+        st.session_state.grafo_scelto = "Custom"
+        st.session_state.loop_grafo_scelto = "Custom"
+        st.session_state.graph_image_path = output_path
+        st.session_state.applied_load_job_id = job.id
 
     with st.expander("Show debug info"):
         st.write("Structures from LOOPY")
-        st.write(l.nodes)
-        st.write(l.edges)
+        st.write(l.node_table)
+        st.write(l.edge_table)
+
+        st.write("Neo4j import time (s)")
+        st.write(job.result["import_timings"])
+
+        st.write("Stage time (s)")
+        st.write(job.timings)
+
+        st.write("Neo4j sessions")
+        st.write(session_stats())
+
+        st.write("MySQL connection pool")
+        st.write(get_pool_metrics())
+
+        st.write("MySQL reachable")
+        st.write(check_health())
+
+        # same uuid and version as the job: the extractions come from its cache
+        analyzer = AnalyzeCLDGraph(
+            st.session_state.session_id, version=job.result["version"]
+        )
+        analyzer.set_database_conf(
+            neo4j_config["url"], neo4j_config["user"], neo4j_config["password"]
+        )
 
         st.write("Structures from Neo4j")
         st.write(analyzer.extract_loops())
 
-        st.write(analyzer.extract_routes())
+        # routes were streamed to MySQL without being kept in memory
+        if job.result["routes"] is None:
+            st.write("Diagram unchanged: stored loops and routes reused")
+        else:
+            st.write(f"Routes written: {job.result['routes']}")
 
         st.write(analyzer.extract_nodes())
 
         st.write(analyzer.extract_edges())
 
-    st.session_state.grafo_scelto = "Custom"
-    st.session_state.loop_grafo_scelto = "Custom"
-    st.session_state.graph_image_path = output_path
+
+job = get_job(st.session_state.get("load_job_id"))
+if job is not None:
+    if not job.finished:
+        show_job_progress(job)
+    elif job.status == "done":
+        show_job_result(job)
+    elif job.status == "cancelled":
+        st.warning("Loading cancelled.")
+    else:
+        st.error(f"Loading failed: {job.error}")
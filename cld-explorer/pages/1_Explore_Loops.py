@@ -1,9 +1,20 @@
-import base64
+import os
+from uuid import uuid4
 
 import pandas as pd
 import streamlit as st
+from bulk_export import EXPORT_FORMATS, EXPORT_PDF_MAX_PAGES, export_pdf, export_zip
 from db_config import get_connection
+from loop_statistics import get_loop_statistics
 from loops_generator import generate_graphs
+from paginated_table import show_paginated_table
+from svg_cache import svg_data_uri
+from query_builder import (
+    NODE_LOOPS_SORT_COLUMNS,
+    node_loops_count_query,
+    node_loops_page_query,
+    session_cld_id,
+)
 
 st.set_page_config(layout="wide", page_title="CLD-Explorer")
 
@@ -11,6 +22,10 @@ st.set_page_config(layout="wide", page_title="CLD-Explorer")
 if "graph_logs" not in st.session_state:
     st.session_state["graph_logs"] = {}
 
+# id della sessione: determina il cldID delle righe custom di questo utente
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid4()
+
 
 def log_activity(activity_description):
 
@@ -28,13 +43,13 @@ def log_activity(activity_description):
     )
 
 
-# esegue la query e ottieni i risultati
-def run_query(query):
+# esegue la query e ottieni i risultati (params: valori per i segnaposto %s della query)
+def run_query(query, params=None):
     conn = get_connection()
     if conn is not None:
         try:
             df = pd.read_sql(
-                query, conn
+                query, conn, params=params
             )  # esegue la query  e restituisce i risultati come dataFrame di Pandas.
             if df.empty:
                 st.warning(
@@ -49,15 +64,12 @@ def run_query(query):
         return pd.DataFrame()  # restituisce un data frame vuoto in caso di errore
 
 
-# funzione per caricare file SVG
-# @st.cache_data  # per memorizzare il risultato della funzione in cache, se viene chiamata più volte con lo stesso image_path
-def load_svg(image_path):
-    try:
-        with open(image_path, "r", encoding="utf-8") as file:
-            return file.read()  # lo restituisce come stringa
-    except FileNotFoundError:
-        st.error(f"File not found: {image_path}")
-        return None
+# numero di righe della tabella paginata delle variabili (COUNT in SQL, senza leggere le righe)
+def get_node_loops_count(table_name, cld_id=None):
+    result = run_query(*node_loops_count_query(table_name, cld_id))
+    if result is not None and not result.empty:
+        return int(result.iloc[0]["row_count"])
+    return 0
 
 
 # aggiorna il grafo selezionato, quando si cambia grafo
@@ -75,14 +87,15 @@ def update_graph_selection():
     elif st.session_state["loop_grafo_scelto"].lower() == "australian hotel":
         st.session_state["graph_image_path"] = "./assets/graph_hotel.svg"
     elif st.session_state["loop_grafo_scelto"].lower() == "custom":
-        st.session_state["graph_image_path"] = "./output/custom_diagram.svg"
+        st.session_state["graph_image_path"] = (
+            f"./output/custom_diagram_{session_cld_id(st.session_state.session_id)}.svg"
+        )
 
 
 # funzione per visualizzare l'immagine SVG con zoom
 def display_svg_with_zoom_pan(image_path, width="100%"):
-    svg_content = load_svg(image_path)
-    if svg_content:
-        svg_encoded = f"data:image/svg+xml;base64,{base64.b64encode(svg_content.encode()).decode()}"  # codifica il contenuto SVG in base64 per renderlo compatibile con HTML.
+    svg_encoded = svg_data_uri(image_path)
+    if svg_encoded:
         st.markdown(
             f"""
             <style>
@@ -117,9 +130,8 @@ def display_svg_with_zoom_pan(image_path, width="100%"):
 
 # la stessa come sopara ma usata per i loop perchè devono essere più piccole le foto e centrate
 def display_loop_svg(image_path, width="500px"):
-    svg_content = load_svg(image_path)
-    if svg_content:
-        svg_encoded = f"data:image/svg+xml;base64,{base64.b64encode(svg_content.encode()).decode()}"
+    svg_encoded = svg_data_uri(image_path)
+    if svg_encoded:
         st.markdown(
             f"""
             <style>
@@ -205,6 +217,10 @@ def show_main_carousel(
 
         display_loop_svg(images[current_index], width="500px")
 
+        # le immagini vicine vengono renderizzate in background, così la navigazione resta immediata
+        if hasattr(images, "prefetch"):
+            images.prefetch(current_index)
+
         # per la visualizazzione dell'indice dell'immagine nel carosello
         st.markdown(
             f"""
@@ -330,6 +346,10 @@ def show_compare_carousel(side_by_side=False):
 
         display_loop_svg(images[current_index], width="500px")
 
+        # le immagini vicine vengono renderizzate in background, così la navigazione resta immediata
+        if hasattr(images, "prefetch"):
+            images.prefetch(current_index)
+
         st.markdown(
             f"""
             <div style='text-align: center; margin-top: 10px;'>
@@ -390,6 +410,55 @@ def show_side_by_side_carousels():
         show_compare_carousel(side_by_side=True)
 
 
+# export di tutti i loops del filtro corrente (ZIP di SVG o PDF), senza passare dal carosello
+def show_bulk_export(images):
+    if not images:
+        return
+
+    st.markdown("### Export all loops")
+    export_format = st.radio(
+        "Export format:", EXPORT_FORMATS, horizontal=True, key="loop_export_format"
+    )
+    if st.button(f"Export {len(images)} loops", key="loop_export_button"):
+        progress_bar = st.progress(0.0, text="Rendering loops...")
+
+        # la barra viene aggiornata a ogni punto percentuale, non a ogni immagine
+        def progress(done, total):
+            if done == total or done * 100 // total != (done - 1) * 100 // total:
+                progress_bar.progress(
+                    done / total, text=f"Rendered {done} of {total} loops"
+                )
+
+        if export_format == EXPORT_FORMATS[0]:
+            export_path = export_zip(images, "loops", progress)
+        else:
+            if len(images) > EXPORT_PDF_MAX_PAGES:
+                st.warning(
+                    f"The PDF contains the first {EXPORT_PDF_MAX_PAGES} loops: use the ZIP export to get all of them."
+                )
+            export_path = export_pdf(images, "loops", "Loop", progress)
+
+        # l'export precedente della sessione non serve più
+        previous_export = st.session_state.get("loop_export_path")
+        if previous_export and os.path.exists(previous_export):
+            os.unlink(previous_export)
+        st.session_state["loop_export_path"] = export_path
+
+    export_path = st.session_state.get("loop_export_path")
+    if export_path and os.path.exists(export_path):
+        with open(export_path, "rb") as f:
+            st.download_button(
+                label="Download export",
+                data=f,
+                file_name=f"loops_export{os.path.splitext(export_path)[1]}",
+                mime=(
+                    "application/zip"
+                    if export_path.endswith(".zip")
+                    else "application/pdf"
+                ),
+            )
+
+
 # funzione principale per la pagina Loop
 def loop_page():
 
@@ -464,6 +533,8 @@ def loop_page():
     )
 
     # determina il grafo scelto e la tabella associata
+    # (cld_id è usato solo dal CLD custom, per leggere le sole righe della sessione)
+    cld_id = None
     if st.session_state["loop_grafo_scelto"].lower() == "covid":
         table_name = "loops_covid"
         grafo = "relationships_covid"
@@ -579,9 +650,12 @@ def loop_page():
     elif st.session_state["loop_grafo_scelto"].lower() == "custom":
         table_name = "loops_custom"
         grafo = "relationships_custom"
-        image_path = "./output/custom_diagram.svg"
+        cld_id = session_cld_id(st.session_state.session_id)
+        image_path = f"./output/custom_diagram_{cld_id}.svg"
         file_name = "graph_from_files1.svg"
-        nodes = run_query(f"SELECT node_name FROM nodes_custom")["node_name"].tolist()
+        nodes = run_query(
+            "SELECT node_name FROM nodes_custom WHERE cldID = %s", [cld_id]
+        )["node_name"].tolist()
         print("Nodes from the custom graph:" + str(nodes))
 
     # visualizzazione del grafo selezionato
@@ -590,50 +664,17 @@ def loop_page():
 
     # Da qua visualizzazione del preview
 
-    # numero totale di loop
-    query_total_loops = f"SELECT count(*) FROM {table_name};"
-    total_loops = run_query(query_total_loops)["count(*)"][0]
-
-    # nmero di loop balancing e reinforcing
-    query_balancing_loops = (
-        f"SELECT count(*) FROM {table_name} WHERE state='balancing';"
-    )
-    balancing_loops = run_query(query_balancing_loops)["count(*)"][0]
-
-    query_reinforcing_loops = (
-        f"SELECT count(*) FROM {table_name} WHERE state='reinforcing';"
-    )
-    reinforcing_loops = run_query(query_reinforcing_loops)["count(*)"][0]
-
-    # numero di loop per range di lunghezza
-    query_loop_length = f"""
-    SELECT 
-        CASE 
-            WHEN l.loop_length <= 5 THEN 'length<=5'
-            WHEN l.loop_length BETWEEN 6 AND 10 THEN '5<length<=10'
-            WHEN l.loop_length BETWEEN 11 AND 15 THEN '10<length<=15'
-            WHEN l.loop_length BETWEEN 16 AND 20 THEN '15<length<=20'
-            WHEN l.loop_length BETWEEN 21 AND 25 THEN '20<length<=25'
-            ELSE 'k>25'
-        END AS length_range,
-        COUNT(*) AS number_of_loops
-    FROM {table_name} AS l
-    GROUP BY length_range;
-    """
-    loop_length_df = run_query(query_loop_length)
-
-    # abella con nodi e numero di loop in cui sono coinvolti
-    query_node_loops = f"""
-    WITH NodeCounts AS (
-        SELECT node_name, COUNT(*) AS count
-        FROM bridge_nodes_{table_name}
-        GROUP BY node_name
-    )
-    SELECT node_name AS variable_name, count AS number_of_loops
-    FROM NodeCounts
-    ORDER BY node_name ASC;
-    """
-    node_loop_df = run_query(query_node_loops)
+    # tutte le metriche della panoramica in un'unica query, in cache per CLD
+    loop_stats = get_loop_statistics(table_name, cld_id)
+    total_loops = loop_stats["total_loops"]
+    balancing_loops = loop_stats["balancing_loops"]
+    reinforcing_loops = loop_stats["reinforcing_loops"]
+    loop_length_df = loop_stats["loop_length_df"]
+    node_loop_df = loop_stats["node_loop_df"]
+    if loop_length_df.empty:
+        st.warning(
+            "There are no results that meet your request. Please try with other filters"
+        )
 
     # layout delle metriche
     st.markdown(f"## Loops Overview")
@@ -653,8 +694,19 @@ def loop_page():
     st.table(loop_length_df)
 
     # visualizzazione della ttabella odi e numero di loop in cui sono coinvolti
+    # paginata: ordinamento e LIMIT/OFFSET in SQL, al browser arriva solo la pagina visibile
     st.markdown("### Variables and the number of distinct loops they are involved in")
-    st.table(node_loop_df)
+    show_paginated_table(
+        "node_loops_table",
+        get_node_loops_count(table_name, cld_id),
+        lambda sort_by, descending, limit, offset: run_query(
+            *node_loops_page_query(
+                table_name, cld_id, sort_by, descending, limit, offset
+            )
+        ),
+        NODE_LOOPS_SORT_COLUMNS,
+        "variable_name",
+    )
 
     # form dei filtri
     st.markdown("## Find Loops")
@@ -717,6 +769,7 @@ def loop_page():
                 loop_length=loop_length,
                 node_name=selected_node,
                 carousel_type="main",
+                cld_id=cld_id,
             )
             # print(f"File generati per il primo carosello: {loop_generated_files}")
             st.session_state["loop_generated_files"] = loop_generated_files
@@ -753,6 +806,7 @@ def loop_page():
         "loop_show_side_by_side", False
     ):
         show_main_carousel()
+        show_bulk_export(st.session_state["loop_generated_files"])
 
         if "loop_show_compare_form" not in st.session_state:
             st.session_state["loop_show_compare_form"] = False
@@ -792,6 +846,7 @@ def loop_page():
                     loop_length=compare_loop_length,
                     node_name=compare_selected_node,
                     carousel_type="compare",
+                    cld_id=cld_id,
                 )
                 # print(f"File generati per il secondo carosello: {compare_loop_generated_files}")
                 st.session_state["compare_loop_generated_files"] = (
@@ -1,9 +1,24 @@
-import base64
+import os
+from uuid import uuid4
 
 import pandas as pd
 import streamlit as st
+from bulk_export import EXPORT_FORMATS, EXPORT_PDF_MAX_PAGES, export_pdf, export_zip
 from db_config import get_connection
+from paginated_table import show_paginated_table
+from path_codec import split_path
+from query_builder import (
+    PATH_CODE_COLUMNS,
+    ROUTE_DETAILS_SORT_COLUMNS,
+    node_names_query,
+    route_count_query,
+    route_details_query,
+    route_end_nodes_query,
+    route_relationships_query,
+    session_cld_id,
+)
 from routes_generator import generate_route_graphs
+from svg_cache import svg_data_uri
 
 st.set_page_config(layout="wide", page_title="CLD-Explorer")
 
@@ -11,6 +26,10 @@ st.set_page_config(layout="wide", page_title="CLD-Explorer")
 if "route_graph_logs" not in st.session_state:
     st.session_state["route_graph_logs"] = {}
 
+# id della sessione: determina il cldID delle righe custom di questo utente
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid4()
+
 
 def log_activity_route(activity_description):
 
@@ -31,13 +50,13 @@ def log_activity_route(activity_description):
     )
 
 
-# funzione per eseguire query
-def run_query(query):
+# funzione per eseguire query (params: valori per i segnaposto %s della query)
+def run_query(query, params=None):
     conn = get_connection()
     if conn is not None:
         try:
             df = pd.read_sql(
-                query, conn
+                query, conn, params=params
             )  # esegue la query  e restituisce i risultati come dataFrame di Pandas.
             return df
         except Exception as e:
@@ -48,16 +67,6 @@ def run_query(query):
         return pd.DataFrame()  # restituisce un data frame vuoto in caso di errore
 
 
-# @st.cache_data
-def load_svg(image_path):
-    try:
-        with open(image_path, "r", encoding="utf-8") as file:
-            return file.read()
-    except FileNotFoundError:
-        st.error(f"File not found: {image_path}")
-        return None
-
-
 # funzione per resettare lo stato della sessione
 def reset_query_state():
 
@@ -67,6 +76,8 @@ def reset_query_state():
         "current_route_image_index",
         "route_type",
         "route_length",
+        "route_through_node",
+        "route_through_relationship",
         "compare_route_generated_files",
         "compare_route_image_index",
         "route_show_compare_form",
@@ -80,12 +91,16 @@ def reset_query_state():
 
     st.session_state["route_type"] = "No Filter"
     st.session_state["route_length"] = "No Filter"
+    st.session_state["route_through_node"] = "No Filter"
+    st.session_state["route_through_relationship"] = "No Filter"
 
 
 def reset_form_state():
 
     st.session_state["route_type"] = "No Filter"
     st.session_state["route_length"] = "No Filter"
+    st.session_state["route_through_node"] = "No Filter"
+    st.session_state["route_through_relationship"] = "No Filter"
 
 
 # funzione per aggiornare la selezione del grafo
@@ -101,14 +116,15 @@ def update_graph_selection():
     elif st.session_state["grafo_scelto"].lower() == "australian hotel":
         st.session_state["graph_image_path"] = "./assets/graph_hotel.svg"
     elif st.session_state["grafo_scelto"].lower() == "custom":
-        st.session_state["graph_image_path"] = "./assets/graph_covid.svg"
+        st.session_state["graph_image_path"] = (
+            f"./output/custom_diagram_{session_cld_id(st.session_state.session_id)}.svg"
+        )
 
 
 # funzione per visualizzare l'immagine SVG con zoom
 def display_svg_with_zoom_pan(image_path, width="100%"):
-    svg_content = load_svg(image_path)
-    if svg_content:
-        svg_encoded = f"data:image/svg+xml;base64,{base64.b64encode(svg_content.encode()).decode()}"  # codifica il contenuto SVG in base64 per renderlo compatibile con HTML.
+    svg_encoded = svg_data_uri(image_path)
+    if svg_encoded:
         st.markdown(
             f"""
             <style>
@@ -143,9 +159,8 @@ def display_svg_with_zoom_pan(image_path, width="100%"):
 
 # la stessa come sopara ma usata per i loop perchè devono essere più piccole le foto e centrate
 def display_route_svg(image_path, width="500px"):
-    svg_content = load_svg(image_path)
-    if svg_content:
-        svg_encoded = f"data:image/svg+xml;base64,{base64.b64encode(svg_content.encode()).decode()}"
+    svg_encoded = svg_data_uri(image_path)
+    if svg_encoded:
         st.markdown(
             f"""
             <style>
@@ -228,6 +243,10 @@ def show_main_carousel(side_by_side=False):
 
         display_route_svg(images[current_index], width="500px")
 
+        # le immagini vicine vengono renderizzate in background, così la navigazione resta immediata
+        if hasattr(images, "prefetch"):
+            images.prefetch(current_index)
+
         st.markdown(
             f"""
             <div style='text-align: center; margin-top: 10px;'>
@@ -318,6 +337,10 @@ def show_compare_carousel(side_by_side=False):
 
         display_route_svg(images[current_index], width="500px")
 
+        # le immagini vicine vengono renderizzate in background, così la navigazione resta immediata
+        if hasattr(images, "prefetch"):
+            images.prefetch(current_index)
+
         st.markdown(
             f"""
             <div style='text-align: center; margin-top: 10px;'>
@@ -374,44 +397,48 @@ def show_side_by_side_carousels():
 
 
 # fnzione per il count delle route
-def get_route_count(table_name, start_node):
-    query = f"""
-        SELECT COUNT(*) AS route_count
-        FROM {table_name}
-        WHERE start_node = '{start_node}';
-    """
-    result = run_query(query)
+def get_route_count(table_name, start_node, cld_id=None):
+    query, params = route_count_query(table_name, start_node, cld_id)
+    result = run_query(query, params)
     if not result.empty:
         return result.iloc[0]["route_count"]
     return 0
 
 
+# end node raggiungibili dal nodo di partenza, in ordine alfabetico
+def get_end_nodes(table_name, start_node, cld_id=None):
+    df = run_query(*route_end_nodes_query(table_name, start_node, cld_id))
+    if df is None or df.empty:
+        return []
+    return sorted(df["end_node"].tolist(), key=lambda x: x.lower())
+
+
 # funzioen per ottenere gli end node e il numero di increasing e decreasing route
+# (con limit solo una pagina, ordinata per sort_by)
 def get_route_details(
-    table_name, start_node, route_length="No Filter", route_type="No Filter"
+    table_name,
+    start_node,
+    route_length="No Filter",
+    route_type="No Filter",
+    cld_id=None,
+    sort_by="number_of_increasing_routes",
+    descending=True,
+    limit=None,
+    offset=0,
 ):
-    query = f"""
-        SELECT 
-            end_node AS end_variable,
-            SUM(CASE WHEN state = 'increasing' THEN 1 ELSE 0 END) AS number_of_increasing_routes,
-            SUM(CASE WHEN state = 'decreasing' THEN 1 ELSE 0 END) AS number_of_decreasing_routes
-        FROM {table_name}
-        WHERE start_node = '{start_node}'
-    """
-
-    # filtro per la lunghezza della route
-    if route_length != "No Filter":
-        query += f" AND route_length = {route_length}"
-
-    # filtro per il tipo di route (increasing, decreasing)
-    if route_type != "No Filter":
-        query += f" AND state = '{route_type}'"
-
-    query += " GROUP BY end_node"
-
-    query += " ORDER BY number_of_increasing_routes DESC;"
-    # Questo ti permetterà di vedere l'output della query
-    df = run_query(query)
+    # query parametrizzata con i filtri per lunghezza e tipo di route (increasing, decreasing)
+    query, params = route_details_query(
+        table_name,
+        start_node,
+        route_length,
+        route_type,
+        cld_id,
+        sort_by,
+        descending,
+        limit,
+        offset,
+    )
+    df = run_query(query, params)
 
     # converte i valori di increasing_count e decreasing_count in numeri interi
     df["number_of_increasing_routes"] = df["number_of_increasing_routes"].astype(int)
@@ -420,6 +447,87 @@ def get_route_details(
     return df
 
 
+# relazioni usate dalle route tra start_node ed end_node, con l'etichetta "variabile -> variabile"
+# ricavata da una route d'esempio (lookup sulla tabella bridge_rel_routes)
+def get_route_relationships(table_name, start_node, end_node, cld_id=None):
+    query, params = route_relationships_query(table_name, start_node, end_node, cld_id)
+    df = run_query(query, params)
+    relationships = {}
+    if df is None or df.empty:
+        return relationships
+    node_names = None
+    if table_name in PATH_CODE_COLUMNS:
+        names = run_query(*node_names_query(table_name, cld_id))
+        node_names = dict(zip(names["nodeID"], names["node_name"]))
+    for relationship_id, route in zip(df["relationshipID"], df["route"]):
+        nodes, edges_ids = split_path(route, node_names)
+        i = edges_ids.index(int(relationship_id))
+        # ASCII: l'etichetta finisce nel log e quindi nel report PDF (font core di fpdf, solo latin-1)
+        relationships[int(relationship_id)] = f"{nodes[i]} -> {nodes[i + 1]}"
+    return dict(sorted(relationships.items(), key=lambda x: x[1].lower()))
+
+
+# selectbox con il valore salvato nello stato della sessione, se è ancora tra le opzioni
+def filter_selectbox(label, options, key, format_func=str):
+    current = st.session_state.get(key, "No Filter")
+    return st.selectbox(
+        label,
+        options,
+        key=key,
+        index=options.index(current) if current in options else 0,
+        format_func=format_func,
+    )
+
+
+# export di tutti i routes del filtro corrente (ZIP di SVG o PDF), senza passare dal carosello
+def show_bulk_export(images):
+    if not images:
+        return
+
+    st.markdown("### Export all routes")
+    export_format = st.radio(
+        "Export format:", EXPORT_FORMATS, horizontal=True, key="route_export_format"
+    )
+    if st.button(f"Export {len(images)} routes", key="route_export_button"):
+        progress_bar = st.progress(0.0, text="Rendering routes...")
+
+        # la barra viene aggiornata a ogni punto percentuale, non a ogni immagine
+        def progress(done, total):
+            if done == total or done * 100 // total != (done - 1) * 100 // total:
+                progress_bar.progress(
+                    done / total, text=f"Rendered {done} of {total} routes"
+                )
+
+        if export_format == EXPORT_FORMATS[0]:
+            export_path = export_zip(images, "routes", progress)
+        else:
+            if len(images) > EXPORT_PDF_MAX_PAGES:
+                st.warning(
+                    f"The PDF contains the first {EXPORT_PDF_MAX_PAGES} routes: use the ZIP export to get all of them."
+                )
+            export_path = export_pdf(images, "routes", "Route", progress)
+
+        # l'export precedente della sessione non serve più
+        previous_export = st.session_state.get("route_export_path")
+        if previous_export and os.path.exists(previous_export):
+            os.unlink(previous_export)
+        st.session_state["route_export_path"] = export_path
+
+    export_path = st.session_state.get("route_export_path")
+    if export_path and os.path.exists(export_path):
+        with open(export_path, "rb") as f:
+            st.download_button(
+                label="Download export",
+                data=f,
+                file_name=f"routes_export{os.path.splitext(export_path)[1]}",
+                mime=(
+                    "application/zip"
+                    if export_path.endswith(".zip")
+                    else "application/pdf"
+                ),
+            )
+
+
 # funzione pagina route
 def route_page():
     # st.set_page_config(layout="wide", page_title="Route Analysis")
@@ -467,6 +575,8 @@ def route_page():
         on_change=update_graph_selection,
     )
 
+    # cld_id è usato solo dal CLD custom, per leggere le sole righe della sessione
+    cld_id = None
     if st.session_state["grafo_scelto"].lower() == "covid":
         table_name = "routes_covid"
         grafo = "relationships_covid"
@@ -579,8 +689,11 @@ def route_page():
     elif st.session_state["grafo_scelto"].lower() == "custom":
         table_name = "routes_custom"
         grafo = "relationships_custom"
-        image_path = "./output/custom_diagram.svg"
-        nodes = run_query(f"SELECT node_name FROM nodes_custom")["node_name"].tolist()
+        cld_id = session_cld_id(st.session_state.session_id)
+        image_path = f"./output/custom_diagram_{cld_id}.svg"
+        nodes = run_query(
+            "SELECT node_name FROM nodes_custom WHERE cldID = %s", [cld_id]
+        )["node_name"].tolist()
 
     # visualizzazione del grafo selezionato
     st.markdown(f"### CLD: {st.session_state['grafo_scelto'].capitalize()}")
@@ -597,33 +710,41 @@ def route_page():
     # da qua visualizzazione del preview
     if selected_node:
         # st.markdown(f"### Routes preview for start variable: {selected_node}")
-        route_count = get_route_count(table_name, selected_node)
+        route_count = get_route_count(table_name, selected_node, cld_id)
         st.metric(
             label=f"Number of routes starting from {selected_node}:", value=route_count
         )
 
-        # Ordina la tabella in base alla colonna 'end_variable'
-        route_details = get_route_details(table_name, selected_node)
-        # route_details = route_details.sort_values(by='end_variable',key=lambda col: col.str.lower())
-
-        st.markdown("### Possible end variables")
-        st.table(route_details)
-
-        if not route_details.empty:
-            end_nodes = sorted(
-                route_details["end_variable"].tolist(), key=lambda x: x.lower()
-            )
-            selected_end_node = st.selectbox(
-                "Choose the end variable:", end_nodes, key="end_variable"
-            )
-            # st.write(f"End node selected: {selected_end_node}")
-
-        if route_details.empty:
+        # solo i nomi degli end node: la tabella con i conteggi viene letta una pagina alla volta
+        end_nodes = get_end_nodes(table_name, selected_node, cld_id)
+        if not end_nodes:
             st.warning(
                 "There are no routes starting from the selected variable. Please try with another variable."
             )
             return
 
+        st.markdown("### Possible end variables")
+        show_paginated_table(
+            "route_details_table",
+            len(end_nodes),
+            lambda sort_by, descending, limit, offset: get_route_details(
+                table_name,
+                selected_node,
+                cld_id=cld_id,
+                sort_by=sort_by,
+                descending=descending,
+                limit=limit,
+                offset=offset,
+            ),
+            ROUTE_DETAILS_SORT_COLUMNS,
+            "number_of_increasing_routes",
+            default_descending=True,
+        )
+
+        selected_end_node = st.selectbox(
+            "Choose the end variable:", end_nodes, key="end_variable"
+        )
+
         # form per selezionare filtri
         st.markdown("## Find Routes")
         with st.form(key="route_filter_form"):
@@ -644,6 +765,26 @@ def route_page():
                 ),
             )
 
+            # filtri per variabile e relazione attraversata: join sulle tabelle bridge delle route,
+            # disponibili per il CLD custom
+            through_node = "No Filter"
+            through_relationship = "No Filter"
+            if cld_id is not None:
+                relationships = get_route_relationships(
+                    table_name, selected_node, selected_end_node, cld_id
+                )
+                through_node = filter_selectbox(
+                    "Select a variable the route passes through:",
+                    ["No Filter"] + nodes,
+                    "route_through_node",
+                )
+                through_relationship = filter_selectbox(
+                    "Select a relationship the route uses:",
+                    ["No Filter"] + list(relationships),
+                    "route_through_relationship",
+                    format_func=lambda x: relationships.get(x, x),
+                )
+
             submit_filter = st.form_submit_button("Submit")
 
         if submit_filter:
@@ -660,7 +801,12 @@ def route_page():
             if "route_previous_carousel_filters" not in st.session_state:
                 st.session_state["route_previous_carousel_filters"] = {}
 
-            current_filters = {"route_type": route_type, "route_length": route_length}
+            current_filters = {
+                "route_type": route_type,
+                "route_length": route_length,
+                "through_node": through_node,
+                "through_relationship": through_relationship,
+            }
 
             if st.session_state["route_previous_carousel_filters"] != current_filters:
                 route_generated_files = generate_route_graphs(
@@ -670,6 +816,9 @@ def route_page():
                     route_type,
                     selected_node,
                     selected_end_node,
+                    cld_id=cld_id,
+                    through_node=through_node,
+                    through_relationship=through_relationship,
                 )
                 if not route_generated_files:
                     st.warning(
@@ -690,13 +839,23 @@ def route_page():
                     )
 
                     # log dell'attività di generazione del primo carosello
-                    if route_type == "No Filter" and route_length == "No Filter":
+                    if all(value == "No Filter" for value in current_filters.values()):
                         log_activity_route(
                             f"You have generated the first carousel with start variable={selected_node} and end variable={selected_end_node}, but without any filter"
                         )
                     else:
                         log_activity_route(
                             f"You have generated the first carousel with the following filters: start variable= {selected_node}, end variable= {selected_end_node}, route type={route_type}, route length={route_length}"
+                            + (
+                                f", through variable={through_node}"
+                                if through_node != "No Filter"
+                                else ""
+                            )
+                            + (
+                                f", through relationship={relationships[through_relationship]}"
+                                if through_relationship != "No Filter"
+                                else ""
+                            )
                         )
             if (
                 "image_path"
@@ -728,6 +887,7 @@ def route_page():
         "route_show_side_by_side", False
     ):
         show_main_carousel()
+        show_bulk_export(st.session_state["route_generated_files"])
 
         # bottone per generare il secondo carosello
         if "route_show_compare_form" not in st.session_state:
@@ -759,6 +919,7 @@ def route_page():
                     route_type=compare_route_type,
                     start_node=selected_node,
                     end_node=selected_end_node,
+                    cld_id=cld_id,
                 )
 
                 # verifica se ci sonorisultati
@@ -0,0 +1,34 @@
+import math
+
+import streamlit as st
+
+#righe per pagina selezionabili
+PAGE_SIZES = (10, 25, 50, 100)
+
+
+#tabella paginata: viene letta e inviata al browser solo la pagina visibile.
+#fetch_page(sort_by, descending, limit, offset) esegue la query (ordinamento e LIMIT/OFFSET in SQL)
+#e restituisce un DataFrame; total_rows è il numero totale di righe della tabella
+def show_paginated_table(key, total_rows, fetch_page, sort_columns, default_sort, default_descending=False):
+    if total_rows == 0:
+        return
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        sort_by = st.selectbox("Sort by", sort_columns, index=sort_columns.index(default_sort), key=f"{key}_sort_by")
+    with col2:
+        order = st.selectbox("Order", ("Ascending", "Descending"), index=int(default_descending), key=f"{key}_order")
+    with col3:
+        page_size = st.selectbox("Rows per page", PAGE_SIZES, index=1, key=f"{key}_page_size")
+
+    pages = math.ceil(total_rows / page_size)
+    #la pagina salvata può non esistere più (meno righe o pagine più grandi)
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = 1
+    with col4:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+
+    offset = (page - 1) * page_size
+    df = fetch_page(sort_by, order == "Descending", page_size, offset)
+    st.dataframe(df, hide_index=True, use_container_width=True)
+    st.caption(f"Rows {offset + 1}-{offset + len(df)} of {total_rows}")
@@ -0,0 +1,32 @@
+import numpy as np
+
+#codifica compatta dei percorsi di loop e route dei CLD custom: array di interi a 32 bit little-endian
+#che alterna id del nodo (nodeID di nodes_custom) e id della relazione, es. [n0, r0, n1, r1, n2].
+#I loop terminano con la relazione che torna al primo nodo, le route con il nodo finale
+PATH_DTYPE = np.dtype('<i4')
+
+
+#path: sequenza alternata di etichette dei nodi e id delle relazioni (come restituita dagli estrattori)
+#node_ids: dizionario etichetta -> nodeID del diagramma
+def encode_path(path, node_ids):
+    codes = [node_ids[step] if i % 2 == 0 else int(step) for i, step in enumerate(path)]
+    return np.array(codes, dtype=PATH_DTYPE).tobytes()
+
+
+#decodifica senza copia: una vista sui byte letti dal database
+def decode_path(code):
+    return np.frombuffer(code, dtype=PATH_DTYPE)
+
+
+#restituisce (nodi, id delle relazioni) di un percorso letto dal database.
+#Con node_names (nodeID -> etichetta) il percorso è codificato, altrimenti è il testo "label, relid, label, ..."
+#delle tabelle dei CLD di esempio
+def split_path(path, node_names=None):
+    if node_names is not None:
+        codes = decode_path(path)
+        return [node_names[node_id] for node_id in codes[0::2].tolist()], codes[1::2].tolist()
+
+    nodes_and_edges = path.split(', ')
+    nodes = [item for item in nodes_and_edges if not item.isdigit()]
+    edges_ids = [int(item) for item in nodes_and_edges if item.isdigit()]
+    return nodes, edges_ids
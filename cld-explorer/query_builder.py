@@ -0,0 +1,243 @@
+import re
+from uuid import UUID
+
+#i nomi di tabella non possono essere parametri SQL: vengono accettati solo identificatori semplici
+_IDENTIFIER = re.compile(r"^[A-Za-z0-9_]+$")
+
+
+def table(name):
+    if not _IDENTIFIER.match(name):
+        raise ValueError(f"Invalid table name: {name}")
+    return name
+
+
+#tabelle riassuntive scritte da LoadAnalyses a ogni import (esistono solo per i CLD custom)
+LOOP_SUMMARY_TABLES = {"loops_custom": ("loop_length_summary_custom", "node_loop_summary_custom")}
+ROUTE_SUMMARY_TABLES = {"routes_custom": "route_summary_custom"}
+
+#colonne con i percorsi codificati da path_codec (i CLD di esempio hanno loop_path e route in testo)
+PATH_CODE_COLUMNS = {"loops_custom": "loop_code", "routes_custom": "route_code"}
+
+
+#cldID di un diagramma custom, derivato dall'UUID della sessione: ogni sessione scrive e legge solo le proprie
+#righe delle tabelle *_custom, quindi più utenti possono importare ed esplorare diagrammi in parallelo
+def session_cld_id(session_id):
+    return UUID(str(session_id)).int % 2_000_000_000 + 1
+
+
+#aggiunge il filtro sul diagramma quando cld_id è indicato (tabelle *_custom); i CLD di esempio non lo usano
+def _scope(conditions, params, cld_id, alias=None):
+    if cld_id is not None:
+        conditions.append(f"{alias + '.' if alias else ''}cldID = %s")
+        params.append(cld_id)
+
+
+def _where(conditions):
+    return " WHERE " + " AND ".join(conditions) if conditions else ""
+
+
+#tabella dei nodi associata a una tabella di loop o route (es. loops_covid -> nodes_covid)
+def nodes_table(table_name):
+    return table(f"nodes_{table_name.split('_', 1)[1]}")
+
+
+#posizioni dei nodi del diagramma
+def node_positions_query(table_name, cld_id=None):
+    conditions, params = [], []
+    _scope(conditions, params, cld_id)
+    return f"SELECT node_name, pos_x, pos_y FROM {nodes_table(table_name)}" + _where(conditions), params
+
+
+#dizionario nodeID -> nome dei nodi, per decodificare i percorsi delle tabelle in PATH_CODE_COLUMNS
+def node_names_query(table_name, cld_id=None):
+    conditions, params = [], []
+    _scope(conditions, params, cld_id)
+    return f"SELECT nodeID, node_name FROM {nodes_table(table_name)}" + _where(conditions), params
+
+
+#tipo e delay delle relazioni del diagramma
+def relations_query(grafo, cld_id=None):
+    conditions, params = [], []
+    _scope(conditions, params, cld_id)
+    return f"SELECT relationshipID, type, delay FROM {table(grafo)}" + _where(conditions), params
+
+
+#query dei loop filtrati: restituisce (sql, parametri) da passare a cursor.execute
+def loops_query(table_name, loop_type="No Filter", loop_length="No Filter", node_name="No Filter", cld_id=None):
+    path = PATH_CODE_COLUMNS.get(table_name, "loop_path")
+    sql = f"SELECT l.{path}, l.state FROM {table(table_name)} AS l"
+    conditions = []
+    params = []
+    _scope(conditions, params, cld_id, "l")
+
+    #il filtro sul nodo usa un JOIN sulla tabella bridge (node_name, loopID)
+    if node_name != "No Filter":
+        sql += f" JOIN bridge_nodes_{table(table_name)} AS b ON b.loopID = l.loopID"
+        if cld_id is not None:
+            sql += " AND b.cldID = l.cldID"
+        conditions.append("b.node_name = %s")
+        params.append(node_name)
+
+    if loop_type != "No Filter":
+        conditions.append("l.state = %s")
+        params.append(loop_type)
+
+    if loop_length != "No Filter":
+        conditions.append("l.loop_length = %s")
+        params.append(int(loop_length))
+
+    return sql + _where(conditions), params
+
+
+#query delle route tra due variabili, servita dall'indice (start_node, end_node, route_length, state).
+#through_node e through_relationship usano le tabelle bridge (node_name, routeID) e (relationshipID, routeID),
+#popolate solo per i CLD custom
+def routes_query(table_name, start_node, end_node, route_length="No Filter", route_type="No Filter", cld_id=None,
+                 through_node="No Filter", through_relationship="No Filter"):
+    path = PATH_CODE_COLUMNS.get(table_name, "route")
+    sql = f"SELECT r.{path}, r.state FROM {table(table_name)} AS r"
+    conditions = ["r.start_node = %s", "r.end_node = %s"]
+    params = [start_node, end_node]
+    _scope(conditions, params, cld_id, "r")
+
+    if through_node != "No Filter":
+        sql += f" JOIN bridge_nodes_{table(table_name)} AS bn ON bn.routeID = r.routeID"
+        if cld_id is not None:
+            sql += " AND bn.cldID = r.cldID"
+        conditions.append("bn.node_name = %s")
+        params.append(through_node)
+
+    if through_relationship != "No Filter":
+        sql += f" JOIN bridge_rel_{table(table_name)} AS br ON br.routeID = r.routeID"
+        if cld_id is not None:
+            sql += " AND br.cldID = r.cldID"
+        conditions.append("br.relationshipID = %s")
+        params.append(int(through_relationship))
+
+    if route_length != "No Filter":
+        conditions.append("r.route_length = %s")
+        params.append(int(route_length))
+
+    if route_type != "No Filter":
+        conditions.append("r.state = %s")
+        params.append(route_type)
+
+    return sql + _where(conditions), params
+
+
+#relazioni usate dalle route tra due variabili, con una route d'esempio da cui ricavare gli estremi
+def route_relationships_query(table_name, start_node, end_node, cld_id=None):
+    path = PATH_CODE_COLUMNS.get(table_name, "route")
+    sql = (
+        f"SELECT br.relationshipID, MIN(r.{path}) AS route FROM {table(table_name)} AS r"
+        f" JOIN bridge_rel_{table(table_name)} AS br ON br.routeID = r.routeID"
+    )
+    conditions = ["r.start_node = %s", "r.end_node = %s"]
+    params = [start_node, end_node]
+    if cld_id is not None:
+        sql += " AND br.cldID = r.cldID"
+    _scope(conditions, params, cld_id, "r")
+    return sql + _where(conditions) + " GROUP BY br.relationshipID", params
+
+
+def route_count_query(table_name, start_node, cld_id=None):
+    if table_name in ROUTE_SUMMARY_TABLES:
+        #righe pre-aggregate per (start_node, end_node, state, route_length)
+        sql = f"SELECT COALESCE(SUM(number_of_routes), 0) AS route_count FROM {ROUTE_SUMMARY_TABLES[table_name]} WHERE start_node = %s"
+    else:
+        sql = f"SELECT COUNT(*) AS route_count FROM {table(table_name)} WHERE start_node = %s"
+    params = [start_node]
+    if cld_id is not None:
+        sql += " AND cldID = %s"
+        params.append(cld_id)
+    return sql, params
+
+
+#ordinamenti ammessi per le tabelle paginate (le colonne non possono essere parametri SQL)
+NODE_LOOPS_SORT_COLUMNS = ("variable_name", "number_of_loops")
+ROUTE_DETAILS_SORT_COLUMNS = ("end_variable", "number_of_increasing_routes", "number_of_decreasing_routes")
+
+
+def _order_and_page(sort_by, sort_columns, descending, tie_breaker, limit, offset, params):
+    if sort_by not in sort_columns:
+        raise ValueError(f"Invalid sort column: {sort_by}")
+    sql = f" ORDER BY {sort_by} {'DESC' if descending else 'ASC'}"
+    if sort_by != tie_breaker:
+        sql += f", {tie_breaker}"  #ordine stabile tra le pagine a parità di valore
+    if limit is not None:
+        sql += " LIMIT %s OFFSET %s"
+        params.extend([int(limit), int(offset)])
+    return sql
+
+
+#numero di righe della tabella "variabile -> numero di loop" (variabili coinvolte in almeno un loop)
+def node_loops_count_query(table_name, cld_id=None):
+    conditions, params = [], []
+    _scope(conditions, params, cld_id)
+    if table_name in LOOP_SUMMARY_TABLES:
+        sql = f"SELECT COUNT(*) AS row_count FROM {LOOP_SUMMARY_TABLES[table_name][1]}" + _where(conditions)
+    else:
+        sql = (f"SELECT COUNT(DISTINCT node_name) AS row_count"
+               f" FROM bridge_nodes_{table(table_name)}" + _where(conditions))
+    return sql, params
+
+
+#una pagina della tabella "variabile -> numero di loop", ordinata e paginata in SQL
+def node_loops_page_query(table_name, cld_id=None, sort_by="variable_name", descending=False, limit=None, offset=0):
+    conditions, params = [], []
+    _scope(conditions, params, cld_id)
+    if table_name in LOOP_SUMMARY_TABLES:
+        sql = (f"SELECT node_name AS variable_name, balancing_loops + reinforcing_loops AS number_of_loops"
+               f" FROM {LOOP_SUMMARY_TABLES[table_name][1]}" + _where(conditions))
+    else:
+        sql = (f"SELECT node_name AS variable_name, COUNT(*) AS number_of_loops"
+               f" FROM bridge_nodes_{table(table_name)}" + _where(conditions) + " GROUP BY node_name")
+    sql += _order_and_page(sort_by, NODE_LOOPS_SORT_COLUMNS, descending, "variable_name", limit, offset, params)
+    return sql, params
+
+
+#end node raggiungibili da start_node (solo i nomi, per la selezione e per contare le righe della tabella)
+def route_end_nodes_query(table_name, start_node, cld_id=None):
+    source = ROUTE_SUMMARY_TABLES.get(table_name) or table(table_name)
+    sql = f"SELECT DISTINCT end_node FROM {source} WHERE start_node = %s"
+    params = [start_node]
+    if cld_id is not None:
+        sql += " AND cldID = %s"
+        params.append(cld_id)
+    return sql, params
+
+
+#end node raggiungibili da start_node con il numero di route increasing e decreasing.
+#Con limit viene restituita solo la pagina richiesta, ordinata in SQL
+def route_details_query(table_name, start_node, route_length="No Filter", route_type="No Filter", cld_id=None,
+                        sort_by="number_of_increasing_routes", descending=True, limit=None, offset=0):
+    #sulla tabella riassuntiva ogni riga vale number_of_routes route, sulla tabella delle route vale 1
+    if table_name in ROUTE_SUMMARY_TABLES:
+        source, routes = ROUTE_SUMMARY_TABLES[table_name], "number_of_routes"
+    else:
+        source, routes = table(table_name), "1"
+    sql = f"""
+        SELECT
+            end_node AS end_variable,
+            SUM(CASE WHEN state = 'increasing' THEN {routes} ELSE 0 END) AS number_of_increasing_routes,
+            SUM(CASE WHEN state = 'decreasing' THEN {routes} ELSE 0 END) AS number_of_decreasing_routes
+        FROM {source}
+        WHERE start_node = %s
+    """
+    params = [start_node]
+
+    if cld_id is not None:
+        sql += " AND cldID = %s"
+        params.append(cld_id)
+
+    if route_length != "No Filter":
+        sql += " AND route_length = %s"
+        params.append(int(route_length))
+
+    if route_type != "No Filter":
+        sql += " AND state = %s"
+        params.append(route_type)
+
+    sql += " GROUP BY end_node"
+    sql += _order_and_page(sort_by, ROUTE_DETAILS_SORT_COLUMNS, descending, "end_variable", limit, offset, params)
+    return sql, params
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cairosvg
+from fpdf import FPDF
+
+from graph_renderer import RENDER_WORKERS, _evict_least_recently_used
+
+#worker per la conversione SVG -> PNG: cairo lavora fuori dal GIL, quindi bastano i thread
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", str(RENDER_WORKERS)))
+
+#cache dei PNG indicizzata per hash del contenuto SVG, condivisa da tutte le sessioni
+PNG_CACHE_DIR = os.getenv("PNG_CACHE_DIR", os.path.join("output", "png_cache"))
+PNG_CACHE_MAX_BYTES = int(os.getenv("PNG_CACHE_MAX_MB", "200")) * 1024 * 1024
+
+
+#converte un SVG in PNG e restituisce il percorso del PNG in cache (None se il file non esiste o non è valido).
+#cache_dir permette di usare una cartella diversa dalla cache condivisa (es. una temporanea per gli export)
+def convert_svg_to_png(svg_path, cache_dir=PNG_CACHE_DIR):
+    try:
+        with open(svg_path, "rb") as svg_file:
+            svg_content = svg_file.read()
+    except OSError:
+        return None
+
+    png_path = os.path.join(cache_dir, f"{hashlib.sha256(svg_content).hexdigest()}.png")
+    try:
+        os.utime(png_path)  #segna il PNG come usato di recente per l'LRU
+        return png_path
+    except FileNotFoundError:
+        pass  #mai convertito o eliminato da _trim_png_cache di un'altra sessione: si riconverte
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{png_path}.{threading.get_ident()}.tmp"
+    try:
+        cairosvg.svg2png(bytestring=svg_content, write_to=tmp_path)
+        os.replace(tmp_path, png_path)  #scrittura atomica, sicura tra sessioni concorrenti
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        return None
+    return png_path
+
+
+#converte in parallelo tutti gli SVG e restituisce il dizionario svg -> png (None per quelli non convertiti)
+def rasterize_images(svg_paths, workers=None):
+    svg_paths = list(dict.fromkeys(svg_paths))  #ogni immagine una sola volta, anche se salvata più volte
+    workers = workers or REPORT_WORKERS
+    if workers <= 1 or len(svg_paths) <= 1:
+        png_paths = [convert_svg_to_png(path) for path in svg_paths]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            png_paths = list(executor.map(convert_svg_to_png, svg_paths))
+
+    _trim_png_cache()
+    return dict(zip(svg_paths, png_paths))
+
+
+def _trim_png_cache():
+    if not os.path.isdir(PNG_CACHE_DIR):
+        return
+    size = sum(entry.stat().st_size for entry in os.scandir(PNG_CACHE_DIR) if entry.name.endswith(".png"))
+    if size > PNG_CACHE_MAX_BYTES:
+        _evict_least_recently_used(PNG_CACHE_MAX_BYTES * 0.8, PNG_CACHE_DIR, ".png")
+
+
+#impronta del log delle attività: il PDF va rigenerato solo quando cambia
+def log_fingerprint(graph_logs):
+    return hashlib.sha256(json.dumps(graph_logs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+#costruisce il PDF del report e lo restituisce come bytes, senza file temporanei.
+#image_key è la chiave del log con l'immagine salvata ('loop_image_path' o 'route_image_path'),
+#item il nome dell'elemento usato nei messaggi ('loop' o 'route')
+def build_pdf_report(title, graph_logs, image_key, item, workers=None):
+    #tutte le immagini del report vengono rasterizzate insieme, prima di comporre le pagine
+    svg_paths = []
+    for activities in graph_logs.values():
+        if 'image_path' in activities[0]:
+            svg_paths.append(activities[0]['image_path'])
+        svg_paths.extend(session[image_key] for session in activities if session.get(image_key))
+    png_paths = rasterize_images(svg_paths, workers)
+
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+
+    # titolo del report
+    pdf.set_font("Arial", "B", 16)
+    pdf.cell(200, 10, txt=title, ln=True, align="C")
+    pdf.set_font("Arial", size=12)  # torna alla dimensione normale del font
+    pdf.ln(10)
+
+    # aggiunge attività nel pdf con funzione cell()
+    for graph, activities in graph_logs.items():
+        pdf.set_font("Arial", "B", 14)
+        pdf.cell(200, 10, txt=f"Selected Graph: {graph}", ln=True, align="L")  # nome grafo
+
+        first_session = activities[0]
+        pdf.set_font("Arial", size=12)
+        formatted_timestamp = first_session['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
+        pdf.cell(200, 10, txt=f"On {formatted_timestamp}, you performed the following activities:", ln=True)
+        pdf.ln(5)
+
+        # aggiunge l'immagine del grafo principale
+        if 'image_path' in first_session:
+            png_image_path = png_paths.get(first_session['image_path'])
+            if png_image_path:
+                pdf.ln(5)
+                pdf.cell(200, 10, txt="Graph Image:", ln=True)
+                pdf.image(png_image_path, x=(210 - 190) // 2, w=190)  # immagine larga e centrata del grafo
+                pdf.ln(10)
+            else:
+                pdf.cell(200, 10, txt="Unable to load the graph image.", ln=True)
+
+        # altre attività + immagini salvate
+        for session in activities:
+            if 'activity' in session and "Hai selezionato il grafo" not in session['activity']:
+                activity_text = session['activity']
+                pdf.multi_cell(0, 10, txt=f"- {activity_text}", align="L")
+
+                # se questa attività è un salvataggio di un'immagine, aggiunge l'immagine sotto l'attività
+                if "You saved the image" in activity_text and session.get(image_key):
+                    saved_png_path = png_paths.get(session[image_key])
+                    if saved_png_path:
+                        pdf.ln(5)
+                        pdf.image(saved_png_path, x=(210 - 120) // 2, w=120)  # immagini centrate nella pagina del pdf
+                    else:
+                        pdf.cell(200, 10, txt=f"Unable to load saved {item} image: {session[image_key]}", ln=True)
+
+        # separatore per ogni sezione
+        pdf.ln(5)
+        pdf.set_draw_color(200, 200, 200)
+        pdf.line(10, pdf.get_y(), 200, pdf.get_y())  # linea separatrice
+        pdf.ln(5)
+
+    #fpdf 1.7 restituisce il documento come stringa latin-1
+    return pdf.output(dest='S').encode('latin-1')
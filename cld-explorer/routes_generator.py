@@ -1,11 +1,14 @@
 import os
-import mysql.connector
 from graphviz import Digraph
 from datetime import datetime
-from db_config import db_config
+from query_builder import routes_query, node_positions_query, relations_query, node_names_query, PATH_CODE_COLUMNS
+from graph_renderer import RENDER_BACKEND, LazyGraphSequence, render_graphs
+from svg_renderer import ROUTE_STYLE, build_svg_graph
+from path_codec import split_path
+from db_config import get_connection
 
 #funzione per generare i grafici delle route in base ai filtri
-def generate_route_graphs(table_name, grafo, route_length="No Filter", route_type="No Filter", start_node=None, end_node=None, carousel_type="main"):
+def generate_route_graphs(table_name, grafo, route_length="No Filter", route_type="No Filter", start_node=None, end_node=None, carousel_type="main", workers=None, save_dot=False, lazy=True, backend=None, cld_id=None, through_node="No Filter", through_relationship="No Filter"):
 #     db_config = {
 #         'host': 'mysql',
 #         'user': 'app',
@@ -13,37 +16,40 @@ def generate_route_graphs(table_name, grafo, route_length="No Filter", route_typ
 #         'database': 'cld'
 #     }
 
+    conn = get_connection()  # connessione dal pool condiviso
+    if conn is None:
+        #MySQL non raggiungibile o pool esaurito (get_connection ha già registrato l'errore): nessun grafo
+        return []
+    cursor = None
     try:
-        conn = mysql.connector.connect(**db_config)
         cursor = conn.cursor()
 
-        #query di base
-        query_routes = f"SELECT r.route, r.state FROM {table_name} as r WHERE r.start_node = '{start_node}' AND r.end_node = '{end_node}'"
-
-        #aggiunge un filtro per la lunghezza della route
-        if route_length != "No Filter":
-            query_routes += f" AND r.route_length = {route_length}"
-
-        #aggiunge un filtro per la lunghezza della route
-        if route_type != "No Filter":
-            query_routes += f" AND r.state = '{route_type}'"
-
-        #execute query
-        cursor.execute(query_routes)
+        #query parametrizzata costruita da query_builder (i valori dei filtri non finiscono mai nella stringa SQL)
+        query_routes, params = routes_query(table_name, start_node, end_node, route_length, route_type, cld_id=cld_id,
+                                             through_node=through_node, through_relationship=through_relationship)
+        cursor.execute(query_routes, params)
         results_routes = cursor.fetchall()
         
         #prende la posizione dei nodi
-        query_positions = f"SELECT node_name, pos_x, pos_y FROM nodes_{table_name.split('_', 1)[1]}"
-        cursor.execute(query_positions)
+        query_positions, params = node_positions_query(table_name, cld_id)
+        cursor.execute(query_positions, params)
         node_positions = {name: (pos_x, pos_y) for name, pos_x, pos_y in cursor.fetchall()}
 
         #prendi i tipi di relazion
-        query_relations = f"SELECT relationshipID, type, delay FROM {grafo}"
-        cursor.execute(query_relations)
+        query_relations, params = relations_query(grafo, cld_id)
+        cursor.execute(query_relations, params)
         relation_types = {rid: (rtype, delay) for rid, rtype, delay in cursor.fetchall()}
 
+        #i percorsi dei CLD custom sono codificati con gli id dei nodi: serve il dizionario nodeID -> nome
+        node_names = None
+        if table_name in PATH_CODE_COLUMNS:
+            query_names, params = node_names_query(table_name, cld_id)
+            cursor.execute(query_names, params)
+            node_names = dict(cursor.fetchall())
+
     finally:
-        cursor.close()
+        if cursor is not None:
+            cursor.close()
         conn.close()
         #pass
 
@@ -55,65 +61,86 @@ def generate_route_graphs(table_name, grafo, route_length="No Filter", route_typ
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
+    #con lazy=True restituisce una sequenza che renderizza ogni route solo quando il carosello ci arriva
+    if lazy:
+        render_specs = build_render_specs(results_routes, carousel_type, node_names)
+        return LazyGraphSequence(render_specs, lambda spec: build_graph(spec, node_positions, relation_types, backend=backend), save_dot=save_dot)
+
     #genera i grafici dai risultati della query
-    generated_files = generate_graphs_from_results(results_routes, node_positions, relation_types, carousel_type=carousel_type)
+    generated_files = generate_graphs_from_results(results_routes, node_positions, relation_types, carousel_type=carousel_type, workers=workers, save_dot=save_dot, backend=backend, node_names=node_names)
     return generated_files
 
 
 #funzione per generare i grafici dai risultati e dalle posizioni dei nodi
-def generate_graphs_from_results(results_routes, node_positions, relation_types, highlight_node=None, carousel_type="main"):
+def generate_graphs_from_results(results_routes, node_positions, relation_types, highlight_node=None, carousel_type="main", workers=None, save_dot=False, backend=None, node_names=None):
+    render_specs = build_render_specs(results_routes, carousel_type, node_names)
+    render_jobs = [(build_graph(spec, node_positions, relation_types, highlight_node, backend), spec['file_name']) for spec in render_specs]
+
+    #i render vengono distribuiti sul pool di worker, l'ordine dei file resta quello dei risultati
+    generated_files = render_graphs(render_jobs, workers=workers, save_dot=save_dot)
+    return generated_files
+
+
+#trasforma i risultati della query in specifiche di render, senza disegnare nulla
+def build_render_specs(results_routes, carousel_type="main", node_names=None):
     output_dir = os.path.join('output', carousel_type)
     
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    generated_files = []
+    render_specs = []
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     for idx, (route, state) in enumerate(results_routes, start=1):
-        nodes_and_edges = route.split(', ')
-        nodes = [item for item in nodes_and_edges if not item.isdigit()]
-        edges_ids = [int(item) for item in nodes_and_edges if item.isdigit()]
+        nodes, edges_ids = split_path(route, node_names)
 
         #crea le relazioni solo tra i nodi consecutivi, senza collegare l'ultimo al primo
         edges = [(nodes[i], nodes[i + 1], edges_ids[i]) for i in range(len(nodes) - 1)]
 
-        dot = Digraph(comment=f'Routes Graph {idx}')
-        
-        #dimensione complessiva dell'immagine bianca
-        dot.attr(size="14,14!", ratio="fill", margin="0.2", pad="1")  
-
-        #dimensioni dei nodi e del testo
-        dot.attr('node', fontsize='24', width='1.5', height='1.5', fixedsize='false', shape='oval')  
-        dot.attr('edge', fontsize='18')  #testo sugli archi 
-
-        #stato della route in basso e centrato
-        dot.attr(label=f'State: {state}', fontsize='30', labelloc='b', labeljust='c', splines='true', overlap='false')
-
-        for node in nodes:
-            if node in node_positions:
-                pos_x, pos_y = node_positions[node]
-                if node == highlight_node:
-                    dot.node(node, pos=f"{pos_x},{pos_y}!", style='filled', color='black', fillcolor='lightblue')
-                else:
-                    dot.node(node, pos=f"{pos_x},{pos_y}!")
-
-        for start_node, end_node, relation_id in edges:
-            relation_type, delay = relation_types.get(relation_id, ('CONC_CHANGE', 'no'))
-            edge_color = 'black'
-            edge_label = ''
-            if delay == 'yes':
-                edge_color = 'red'
-                edge_label = 'Delay'
-
-            if relation_type == 'CONC_CHANGE':
-                dot.edge(start_node, end_node, style='solid', color=edge_color, label=edge_label)
-            elif relation_type == 'DISC_CHANGE':
-                dot.edge(start_node, end_node, style='dashed', color=edge_color, label=edge_label)
-
         file_name = f'{output_dir}/route_graph_{idx}_{state}_{len(nodes)}nodes_{timestamp}'
-        dot.save(f'{file_name}.dot')
-        dot.render(file_name, format='svg')
-        generated_files.append(f'{file_name}.svg')
+        render_specs.append({'idx': idx, 'nodes': nodes, 'edges': edges, 'state': state, 'file_name': file_name})
 
-    return generated_files
+    return render_specs
 
+
+#costruisce il grafo graphviz di una route a partire dalla sua specifica
+def build_graph(spec, node_positions, relation_types, highlight_node=None, backend=None):
+    #backend nativo: SVG scritto direttamente dalle posizioni dei nodi, senza sottoprocesso di graphviz
+    if (backend or RENDER_BACKEND) == 'native':
+        return build_svg_graph(spec, node_positions, relation_types, highlight_node, style=ROUTE_STYLE)
+
+    nodes, edges, state = spec['nodes'], spec['edges'], spec['state']
+
+    dot = Digraph(comment=f'Routes Graph {spec["idx"]}')
+    
+    #dimensione complessiva dell'immagine bianca
+    dot.attr(size="14,14!", ratio="fill", margin="0.2", pad="1")  
+
+    #dimensioni dei nodi e del testo
+    dot.attr('node', fontsize='24', width='1.5', height='1.5', fixedsize='false', shape='oval')  
+    dot.attr('edge', fontsize='18')  #testo sugli archi 
+
+    #stato della route in basso e centrato
+    dot.attr(label=f'State: {state}', fontsize='30', labelloc='b', labeljust='c', splines='true', overlap='false')
+
+    for node in nodes:
+        if node in node_positions:
+            pos_x, pos_y = node_positions[node]
+            if node == highlight_node:
+                dot.node(node, pos=f"{pos_x},{pos_y}!", style='filled', color='black', fillcolor='lightblue')
+            else:
+                dot.node(node, pos=f"{pos_x},{pos_y}!")
+
+    for start_node, end_node, relation_id in edges:
+        relation_type, delay = relation_types.get(relation_id, ('CONC_CHANGE', 'no'))
+        edge_color = 'black'
+        edge_label = ''
+        if delay == 'yes':
+            edge_color = 'red'
+            edge_label = 'Delay'
+
+        if relation_type == 'CONC_CHANGE':
+            dot.edge(start_node, end_node, style='solid', color=edge_color, label=edge_label)
+        elif relation_type == 'DISC_CHANGE':
+            dot.edge(start_node, end_node, style='dashed', color=edge_color, label=edge_label)
+
+    return dot
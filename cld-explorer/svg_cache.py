@@ -0,0 +1,62 @@
+import base64
+import os
+import threading
+from collections import OrderedDict
+
+#cache in memoria dei data URI degli SVG mostrati nelle pagine, condivisa da tutte le sessioni del processo.
+#Streamlit riesegue lo script a ogni click: senza cache ogni rerun rilegge e ricodifica in base64
+#anche i CLD di esempio più grandi. La chiave è (percorso, mtime, dimensione), quindi un file
+#riscritto (es. il diagramma custom di una sessione) viene riletto automaticamente
+SVG_CACHE_MAX_BYTES = int(os.getenv("SVG_CACHE_MAX_MB", "64")) * 1024 * 1024
+
+_cache = OrderedDict()  #percorso -> (firma del file, data URI)
+_cache_size = 0
+_lock = threading.Lock()
+
+
+def _signature(stat):
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _load(image_path):
+    global _cache_size
+    try:
+        signature = _signature(os.stat(image_path))
+    except OSError:
+        return None
+
+    with _lock:
+        entry = _cache.get(image_path)
+        if entry is not None and entry[0] == signature:
+            _cache.move_to_end(image_path)
+            return entry
+
+    try:
+        with open(image_path, "rb") as file:
+            svg_content = file.read()
+    except OSError:
+        return None
+    #si tiene solo il data URI, l'unica forma usata dalle pagine
+    entry = (signature, f"data:image/svg+xml;base64,{base64.b64encode(svg_content).decode()}")
+
+    with _lock:
+        previous = _cache.pop(image_path, None)
+        if previous is not None:
+            _cache_size -= _entry_size(previous)
+        _cache[image_path] = entry
+        _cache_size += _entry_size(entry)
+        #eviction LRU: gli SVG usati meno di recente escono per primi
+        while _cache_size > SVG_CACHE_MAX_BYTES and len(_cache) > 1:
+            _, evicted = _cache.popitem(last=False)
+            _cache_size -= _entry_size(evicted)
+    return entry
+
+
+def _entry_size(entry):
+    return len(entry[1])
+
+
+#SVG codificato come data URI base64, pronto per <img src="..."> (None se il file non esiste)
+def svg_data_uri(image_path):
+    entry = _load(image_path)
+    return entry[1] if entry else None
@@ -0,0 +1,262 @@
+import math
+import time
+from xml.sax.saxutils import escape
+
+#parametri di stile dei grafici dei loop e delle route (gli stessi passati a graphviz nei generatori)
+LOOP_STYLE = {'size': 7, 'node_fontsize': 12, 'node_width': 0.5, 'node_height': 0.5, 'edge_fontsize': 10, 'label_fontsize': 20}
+ROUTE_STYLE = {'size': 14, 'node_fontsize': 24, 'node_width': 1.5, 'node_height': 1.5, 'edge_fontsize': 18, 'label_fontsize': 30}
+
+POINTS_PER_INCH = 72
+ARROW_LENGTH = 10
+FONT_FAMILY = 'Times,serif'  #font di default di graphviz
+
+
+#grafo disegnato direttamente in SVG a partire dalle posizioni fisse dei nodi, senza sottoprocesso di graphviz.
+#espone la parte dell'interfaccia di graphviz.Digraph usata da graph_renderer (pipe, render, save e attributi per la cache)
+class SvgGraph:
+    engine = 'native'
+
+    def __init__(self, size, node_fontsize, node_width, node_height, edge_fontsize, label_fontsize, label=''):
+        self.graph_attr = {'size': size, 'label': label, 'label_fontsize': label_fontsize}
+        self.node_attr = {'fontsize': node_fontsize, 'width': node_width, 'height': node_height}
+        self.edge_attr = {'fontsize': edge_fontsize}
+        self.body = []  #istruzioni di disegno, usate anche come contenuto per la chiave della cache
+        self.nodes = {}
+        self.edges = []
+
+    def node(self, name, pos=None, fillcolor='white'):
+        self.nodes[name] = (pos, fillcolor)
+        self.body.append(('node', name, pos, fillcolor))
+
+    def edge(self, start_node, end_node, style='solid', color='black', label=''):
+        self.edges.append((start_node, end_node, style, color, label))
+        self.body.append(('edge', start_node, end_node, style, color, label))
+
+    def pipe(self, format='svg', encoding=None):
+        if format != 'svg':
+            raise ValueError(f"Unsupported format for the native renderer: {format}")
+        svg = self.to_svg()
+        return svg if encoding else svg.encode('utf-8')
+
+    def render(self, file_name, format='svg'):
+        with open(f'{file_name}.{format}', 'wb') as svg_file:
+            svg_file.write(self.pipe(format=format))
+        return f'{file_name}.{format}'
+
+    def save(self, file_name):
+        with open(file_name, 'w', encoding='utf-8') as source_file:
+            source_file.write('\n'.join(repr(statement) for statement in self.body))
+        return file_name
+
+    def to_svg(self):
+        side = self.graph_attr['size'] * POINTS_PER_INCH
+        pad = POINTS_PER_INCH
+        caption_height = self.graph_attr['label_fontsize'] * 2 if self.graph_attr['label'] else 0
+        width, height = side + 2 * pad, side + 2 * pad + caption_height
+
+        #dimensioni delle ellissi: larghezza minima dello stile o quella necessaria per l'etichetta
+        node_fontsize = self.node_attr['fontsize']
+        radii = {}
+        for name in self._all_node_names():
+            text_width = _text_width(name, node_fontsize)
+            radii[name] = (
+                max(self.node_attr['width'] * POINTS_PER_INCH / 2, text_width / 2 + node_fontsize * 0.6),
+                max(self.node_attr['height'] * POINTS_PER_INCH / 2, node_fontsize * 0.9),
+            )
+
+        centers = self._layout(pad, side, radii)
+
+        parts = [
+            '<?xml version="1.0" encoding="UTF-8" standalone="no"?>',
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}pt" height="{height:.0f}pt" viewBox="0 0 {width:.2f} {height:.2f}">',
+            f'<rect x="0" y="0" width="{width:.2f}" height="{height:.2f}" fill="white" stroke="none"/>',
+        ]
+
+        edge_pairs = {(start, end) for start, end, *_ in self.edges}
+        for start_node, end_node, style, color, label in self.edges:
+            curved = (end_node, start_node) in edge_pairs or start_node == end_node
+            parts.append(self._edge_svg(centers, radii, start_node, end_node, style, color, label, curved))
+
+        for name in self._all_node_names():
+            (cx, cy), (rx, ry) = centers[name], radii[name]
+            fillcolor = self.nodes.get(name, (None, 'white'))[1]
+            parts.append(
+                f'<g class="node"><title>{escape(name)}</title>'
+                f'<ellipse cx="{cx:.2f}" cy="{cy:.2f}" rx="{rx:.2f}" ry="{ry:.2f}" fill="{fillcolor}" stroke="black"/>'
+                f'<text text-anchor="middle" x="{cx:.2f}" y="{cy + node_fontsize * 0.35:.2f}" font-family="{FONT_FAMILY}" font-size="{node_fontsize}">{escape(name)}</text></g>'
+            )
+
+        if self.graph_attr['label']:
+            parts.append(
+                f'<text text-anchor="middle" x="{width / 2:.2f}" y="{height - pad / 2:.2f}" font-family="{FONT_FAMILY}" '
+                f'font-size="{self.graph_attr["label_fontsize"]}">{escape(self.graph_attr["label"])}</text>'
+            )
+        parts.append('</svg>')
+        return '\n'.join(parts)
+
+    def _all_node_names(self):
+        names = list(self.nodes)
+        for start_node, end_node, *_ in self.edges:
+            for name in (start_node, end_node):
+                if name not in self.nodes and name not in names:
+                    names.append(name)
+        return names
+
+    #porta le posizioni dei nodi nell'area di disegno mantenendo le proporzioni (y verso l'alto come in graphviz)
+    def _layout(self, pad, side, radii):
+        positioned = {name: pos for name, (pos, _) in self.nodes.items() if pos is not None}
+        names = self._all_node_names()
+        missing = [name for name in names if name not in positioned]
+
+        if positioned:
+            xs = [x for x, _ in positioned.values()]
+            ys = [y for _, y in positioned.values()]
+            min_x, max_x, min_y, max_y = min(xs), max(xs), min(ys), max(ys)
+        else:
+            min_x, max_x, min_y, max_y = 0, 1, 0, 1
+        #i nodi senza posizione vengono disposti su un cerchio attorno al centro
+        for i, name in enumerate(missing):
+            angle = 2 * math.pi * i / len(missing)
+            cx, cy = (min_x + max_x) / 2, (min_y + max_y) / 2
+            r = max(max_x - min_x, max_y - min_y, 1) / 2
+            positioned[name] = (cx + r * math.cos(angle), cy + r * math.sin(angle))
+            min_x, max_x = min(min_x, positioned[name][0]), max(max_x, positioned[name][0])
+            min_y, max_y = min(min_y, positioned[name][1]), max(max_y, positioned[name][1])
+
+        max_rx = max((rx for rx, _ in radii.values()), default=0)
+        max_ry = max((ry for _, ry in radii.values()), default=0)
+        span_x, span_y = max_x - min_x, max_y - min_y
+        scale_x = (side - 2 * max_rx) / span_x if span_x else math.inf
+        scale_y = (side - 2 * max_ry) / span_y if span_y else math.inf
+        scale = min(scale_x, scale_y)
+        if scale == math.inf:
+            scale = 1
+
+        offset_x = pad + (side - span_x * scale) / 2
+        offset_y = pad + (side - span_y * scale) / 2
+        return {
+            name: (offset_x + (x - min_x) * scale, offset_y + (max_y - y) * scale)
+            for name, (x, y) in positioned.items()
+        }
+
+    def _edge_svg(self, centers, radii, start_node, end_node, style, color, label, curved):
+        (x1, y1), (x2, y2) = centers[start_node], centers[end_node]
+        dx, dy = x2 - x1, y2 - y1
+        length = math.hypot(dx, dy) or 1.0
+
+        #punto di controllo della curva: spostato di lato per separare gli archi A->B e B->A
+        bend = 0.2 * length if curved else 0.0
+        if start_node == end_node:
+            rx, ry = radii[start_node]
+            ctrl = (x1 + rx * 2, y1 - ry * 2)
+        else:
+            ctrl = ((x1 + x2) / 2 - dy / length * bend, (y1 + y2) / 2 + dx / length * bend)
+
+        start = _ellipse_boundary(centers[start_node], radii[start_node], ctrl)
+        tip = _ellipse_boundary(centers[end_node], radii[end_node], ctrl)
+        ux, uy = tip[0] - ctrl[0], tip[1] - ctrl[1]
+        norm = math.hypot(ux, uy) or 1.0
+        ux, uy = ux / norm, uy / norm
+        end = (tip[0] - ux * ARROW_LENGTH, tip[1] - uy * ARROW_LENGTH)
+        left = (end[0] - uy * ARROW_LENGTH * 0.35, end[1] + ux * ARROW_LENGTH * 0.35)
+        right = (end[0] + uy * ARROW_LENGTH * 0.35, end[1] - ux * ARROW_LENGTH * 0.35)
+
+        dash = ' stroke-dasharray="5,2"' if style == 'dashed' else ''
+        svg = (
+            f'<g class="edge"><title>{escape(start_node)}&#45;&gt;{escape(end_node)}</title>'
+            f'<path fill="none" stroke="{color}"{dash} d="M{start[0]:.2f},{start[1]:.2f} Q{ctrl[0]:.2f},{ctrl[1]:.2f} {end[0]:.2f},{end[1]:.2f}"/>'
+            f'<polygon fill="{color}" stroke="{color}" points="{tip[0]:.2f},{tip[1]:.2f} {left[0]:.2f},{left[1]:.2f} {right[0]:.2f},{right[1]:.2f}"/>'
+        )
+        if label:
+            mid_x = 0.25 * start[0] + 0.5 * ctrl[0] + 0.25 * end[0]
+            mid_y = 0.25 * start[1] + 0.5 * ctrl[1] + 0.25 * end[1]
+            svg += (
+                f'<text text-anchor="middle" x="{mid_x:.2f}" y="{mid_y - 4:.2f}" font-family="{FONT_FAMILY}" '
+                f'font-size="{self.edge_attr["fontsize"]}" fill="{color}">{escape(label)}</text>'
+            )
+        return svg + '</g>'
+
+
+#larghezza approssimata di un testo (graphviz usa le metriche del font, qui basta una stima)
+def _text_width(text, fontsize):
+    return len(text) * fontsize * 0.55
+
+
+#punto sul bordo dell'ellisse nella direzione di target
+def _ellipse_boundary(center, radii, target):
+    (cx, cy), (rx, ry) = center, radii
+    dx, dy = target[0] - cx, target[1] - cy
+    if dx == 0 and dy == 0:
+        return center
+    t = 1 / math.sqrt((dx / rx) ** 2 + (dy / ry) ** 2)
+    return (cx + dx * t, cy + dy * t)
+
+
+#costruisce l'SVG nativo di un loop o di una route a partire dalla specifica di render dei generatori
+def build_svg_graph(spec, node_positions, relation_types, highlight_node=None, style=LOOP_STYLE):
+    graph = SvgGraph(label=f"State: {spec['state']}", **style)
+    for node in spec['nodes']:
+        if node in node_positions:
+            pos_x, pos_y = node_positions[node]
+            graph.node(node, pos=(float(pos_x), float(pos_y)), fillcolor='lightblue' if node == highlight_node else 'white')
+
+    for start_node, end_node, relation_id in spec['edges']:
+        relation_type, delay = relation_types.get(relation_id, ('CONC_CHANGE', 'no'))
+        edge_color = 'red' if delay == 'yes' else 'black'
+        edge_label = 'Delay' if delay == 'yes' else ''
+        if relation_type == 'CONC_CHANGE':
+            graph.edge(start_node, end_node, style='solid', color=edge_color, label=edge_label)
+        elif relation_type == 'DISC_CHANGE':
+            graph.edge(start_node, end_node, style='dashed', color=edge_color, label=edge_label)
+    return graph
+
+
+#confronta i tempi di render dei due backend su un insieme di specifiche, con la stessa funzione usata dai
+#caroselli: build_graph di loops_generator (default) o di routes_generator
+def benchmark_backends(render_specs, node_positions, relation_types, build_graph=None, backends=('native', 'graphviz')):
+    if build_graph is None:
+        from loops_generator import build_graph  #import locale: loops_generator importa questo modulo
+
+    timings = {}
+    for backend in backends:
+        not_available = ()
+        if backend == 'graphviz':
+            try:
+                from graphviz import ExecutableNotFound  #backend opzionale
+            except ImportError:
+                timings[backend] = None
+                continue
+            not_available = (ExecutableNotFound,)  #pacchetto python presente ma eseguibile dot mancante
+
+        start = time.perf_counter()
+        try:
+            for spec in render_specs:
+                build_graph(spec, node_positions, relation_types, backend=backend).pipe(format='svg')
+        except not_available:
+            timings[backend] = None
+            continue
+        elapsed = time.perf_counter() - start
+        timings[backend] = {'total_s': elapsed, 'per_graph_ms': 1000 * elapsed / max(len(render_specs), 1)}
+    return timings
+
+
+if __name__ == '__main__':
+    #benchmark sintetico: loop su anelli di 2..20 nodi disposti su un cerchio
+    import sys
+
+    n_graphs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    names = [f'variable_{i}' for i in range(20)]
+    positions = {name: (500 * math.cos(2 * math.pi * i / 20), 500 * math.sin(2 * math.pi * i / 20)) for i, name in enumerate(names)}
+    relations = {i: ('DISC_CHANGE' if i % 3 == 0 else 'CONC_CHANGE', 'yes' if i % 5 == 0 else 'no') for i in range(20)}
+    specs = []
+    for k in range(n_graphs):
+        length = 2 + k % 19
+        nodes = names[:length]
+        edges = [(nodes[i], nodes[(i + 1) % length], i) for i in range(length)]
+        specs.append({'idx': k + 1, 'nodes': nodes, 'edges': edges, 'state': 'reinforcing'})
+
+    for backend, result in benchmark_backends(specs, positions, relations).items():
+        if result is None:
+            print(f"{backend:>9}: not available")
+            continue
+        print(f"{backend:>9}: {result['total_s']:.3f} s total, {result['per_graph_ms']:.2f} ms per graph")